@@ -13,9 +13,8 @@ formatter = logging.Formatter('%(asctime)s - %(module)23s.%(funcName)20s - %(lev
 NB_filt = np.array([xx for xx in range(len(filt_ref)) if 'NB' in filt_ref[xx]])
 filter_vars = [filt_ref, dNB, lambdac, dBB, epsilon]
 filter_vars_name = ['filt_ref', 'dNB', 'lambdac', 'dBB', 'epsilon']
-filter_dict = dict()
-for name, var in zip(filter_vars_name, filter_vars):
-    filter_dict[name] = np.array(var)[NB_filt]
+filter_dict = {name: np.asarray(var)[NB_filt] for name, var in
+               zip(filter_vars_name, filter_vars)}
 
 # Colors for each separate points on avg_sigma plots
 avg_sig_ctype = ['m', 'r', 'g', 'b', 'k']
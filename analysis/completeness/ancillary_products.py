@@ -20,6 +20,22 @@ from .config import m_NB
 
 from .config import path0, filters
 from . import MLog
+from .dataset import clear_mact_cache
+
+
+def get_filter_index(NB_tab):
+    """
+    Return dictionary of indices of H-alpha emitters for each NB filter.
+    A galaxy belongs to a filter if NAME0 contains 'Ha-' + filter and the
+    'filt' column matches
+    """
+
+    NB_HA_Name = NB_tab['NAME0'].data.astype(str)
+    NB_filt    = NB_tab['filt'].data.astype(str)
+
+    return {filt: np.flatnonzero((NB_filt == filt) &
+                                 (np.char.find(NB_HA_Name, 'Ha-' + filt) >= 0))
+            for filt in filters}
 
 
 def mag_vs_mass(silent=False):  # verbose=True):
@@ -53,35 +69,34 @@ def mag_vs_mass(silent=False):  # verbose=True):
 
     log.info("Reading : " + NB_file)
     NB_tab     = asc.read(NB_file)
-    NB_HA_Name = NB_tab['NAME0'].data
+    NB_HA_Name = NB_tab['NAME0'].data.astype(str)
     NB_Ha_ID   = NB_tab['ID'].data - 1  # Relative to 0 --> indexing
 
     # Read in stellar mass results table
     FAST_file = join(path0, 'FAST/outputs',
                      'NB_IA_emitters_allphot.emagcorr.ACpsf_fast.GALEX.fout')
     log.info("Reading : " + FAST_file)
-    FAST_tab = asc.read(FAST_file)
-
-    logM = FAST_tab['col7'].data
+    logM = np.loadtxt(FAST_file, usecols=6)  # col #7
 
     logM_NB_Ha = logM[NB_Ha_ID]
 
     NB_catfile = join(path0, 'Catalogs', 'NB_IA_emitters.allcols.colorrev.fix.errors.fits')
     log.info("Reading : " + NB_catfile)
     NB_catdata = fits.getdata(NB_catfile)
-    NB_catdata = NB_catdata[NB_Ha_ID]
 
-    cont_mag = np.zeros(len(NB_catdata))
+    # Rows are gathered per column with NB_Ha_ID rather than copying all
+    # columns of the catalog with NB_catdata[NB_Ha_ID]
+    cont_mag = np.zeros(len(NB_Ha_ID))
 
     fig, ax = plt.subplots(ncols=2, nrows=2)
 
+    filt_idx = get_filter_index(NB_tab)
     for filt in filters:
         log.info('### Working on : ' + filt)
-        NB_idx = np.array([ii for ii in range(len(NB_tab)) if
-                           (('Ha-'+filt in NB_HA_Name[ii]) and (NB_tab['filt'][ii] == filt))])
+        NB_idx = filt_idx[filt]
 
         print(" Size : ", len(NB_idx))
-        cont_mag[NB_idx] = NB_catdata[filt+'_CONT_MAG'][NB_idx]
+        cont_mag[NB_idx] = NB_catdata[filt+'_CONT_MAG'][NB_Ha_ID[NB_idx]]
 
     for rr in range(2):
         for cc in range(2):
@@ -101,8 +116,7 @@ def mag_vs_mass(silent=False):  # verbose=True):
     for ff in range(len(prefixes)):
         col = ff % 2
         row = ff / 2
-        NB_idx = np.array([ii for ii in range(len(NB_tab)) if prefixes[ff] in
-                           NB_HA_Name[ii]])
+        NB_idx = np.flatnonzero(np.char.find(NB_HA_Name, prefixes[ff]) >= 0)
         t_ax = ax[row][col]
         t_ax.scatter(cont_mag[NB_idx], logM_NB_Ha[NB_idx], edgecolor='blue',
                      color='none', alpha=0.5)
@@ -113,16 +127,26 @@ def mag_vs_mass(silent=False):  # verbose=True):
         x_min    = np.min(cont_mag[NB_idx])
         x_max    = np.max(cont_mag[NB_idx])
         cont_arr = np.arange(x_min, x_max+dmag, dmag)
+
+        # Group galaxies into [cont_arr, cont_arr+dmag) bins in one pass
+        t_cont = cont_mag[NB_idx]
+        t_logM = logM_NB_Ha[NB_idx]
+        cc_idx = np.searchsorted(cont_arr, t_cont, side='right') - 1
+        in_bin = (cc_idx >= 0) & (t_cont < cont_arr[cc_idx.clip(0)] + dmag)
+        cc_idx = cc_idx[in_bin]
+        t_logM = t_logM[in_bin]
+
+        N_logM   = np.bincount(cc_idx, minlength=len(cont_arr)).astype(float)
         avg_logM = np.zeros(len(cont_arr))
         std_logM = np.zeros(len(cont_arr))
-        N_logM   = np.zeros(len(cont_arr))
-        for cc in range(len(cont_arr)):
-            cc_idx = np.where((cont_mag[NB_idx] >= cont_arr[cc]) &
-                              (cont_mag[NB_idx] < cont_arr[cc]+dmag))[0]
-            if len(cc_idx) > 0:
-                avg_logM[cc] = np.average(logM_NB_Ha[NB_idx[cc_idx]])
-                std_logM[cc] = np.std(logM_NB_Ha[NB_idx[cc_idx]])
-                N_logM[cc]   = len(cc_idx)
+        has_gal  = N_logM > 0
+        avg_logM[has_gal] = (np.bincount(cc_idx, weights=t_logM,
+                                         minlength=len(cont_arr))[has_gal] /
+                             N_logM[has_gal])
+        dev_sq = (t_logM - avg_logM[cc_idx]) ** 2
+        std_logM[has_gal] = np.sqrt(np.bincount(cc_idx, weights=dev_sq,
+                                                minlength=len(cont_arr))[has_gal] /
+                                    N_logM[has_gal])
 
         t_ax.scatter(cont_arr+dmag/2, avg_logM, marker='o', color='black',
                      edgecolor='none')
@@ -158,7 +182,6 @@ def get_EW_Flux_distribution():
 
     log.info("Reading : " + NB_file)
     NB_tab      = asc.read(NB_file)
-    NB_HA_Name  = NB_tab['NAME0'].data
     NB_Ha_ID    = NB_tab['ID'].data - 1  # Relative to 0 --> indexing
     NII_Ha_corr = NB_tab['nii_ha_corr_factor'].data  # This is -1*log(1+NII/Ha)
     filt_corr   = NB_tab['filt_corr_factor'].data  # This is log(f_filt)
@@ -167,43 +190,50 @@ def get_EW_Flux_distribution():
     NB_catfile = join(path0, 'Catalogs', 'NB_IA_emitters.allcols.colorrev.fix.errors.fits')
     log.info("Reading : " + NB_catfile)
     NB_catdata = fits.getdata(NB_catfile)
-    NB_catdata = NB_catdata[NB_Ha_ID]
+
+    # Rows are gathered per column with NB_Ha_ID rather than copying all
+    # columns of the catalog with NB_catdata[NB_Ha_ID]
+    N_gal = len(NB_Ha_ID)
 
     # These are the raw measurements
-    NB_EW   = np.zeros(len(NB_catdata))
-    NB_Flux = np.zeros(len(NB_catdata))
+    NB_EW   = np.zeros(N_gal)
+    NB_Flux = np.zeros(N_gal)
 
-    Ha_EW   = np.zeros(len(NB_catdata))
-    Ha_Flux = np.zeros(len(NB_catdata))
+    Ha_EW   = np.zeros(N_gal)
+    Ha_Flux = np.zeros(N_gal)
 
-    logMstar = np.zeros(len(NB_catdata))
-    Ha_SFR   = np.zeros(len(NB_catdata))
-    Ha_Lum   = np.zeros(len(NB_catdata))
+    logMstar = np.zeros(N_gal)
+    Ha_SFR   = np.zeros(N_gal)
+    Ha_Lum   = np.zeros(N_gal)
 
-    NBmag   = np.zeros(len(NB_catdata))
-    contmag = np.zeros(len(NB_catdata))
+    NBmag   = np.zeros(N_gal)
+    contmag = np.zeros(N_gal)
 
-    spec_flag = np.zeros(len(NB_catdata))
+    spec_flag = np.zeros(N_gal)
 
+    filt_idx = get_filter_index(NB_tab)
     for filt in filters:
         log.info('### Working on : ' + filt)
-        NB_idx = np.array([ii for ii in range(len(NB_tab)) if
-                           (('Ha-'+filt in NB_HA_Name[ii]) and (NB_tab['filt'][ii] == filt))])
+        NB_idx = filt_idx[filt]
 
         print(" Size : ", len(NB_idx))
-        NB_EW[NB_idx]   = np.log10(NB_catdata[filt+'_EW'][NB_idx])
-        NB_Flux[NB_idx] = NB_catdata[filt+'_FLUX'][NB_idx]
+        cat_idx = NB_Ha_ID[NB_idx]
+        NB_EW[NB_idx]   = np.log10(NB_catdata[filt+'_EW'][cat_idx])
+        NB_Flux[NB_idx] = NB_catdata[filt+'_FLUX'][cat_idx]
 
-        Ha_EW[NB_idx]   = (NB_EW + NII_Ha_corr + filt_corr)[NB_idx]
-        Ha_Flux[NB_idx] = (NB_Flux + NII_Ha_corr + filt_corr)[NB_idx]
+        # Only the rows of this filter are corrected
+        t_NII_corr  = NII_Ha_corr[NB_idx]
+        t_filt_corr = filt_corr[NB_idx]
+        Ha_EW[NB_idx]   = NB_EW[NB_idx] + t_NII_corr + t_filt_corr
+        Ha_Flux[NB_idx] = NB_Flux[NB_idx] + t_NII_corr + t_filt_corr
 
-        NBmag[NB_idx]   = NB_catdata[filt+'_MAG'][NB_idx]
-        contmag[NB_idx] = NB_catdata[filt+'_CONT_MAG'][NB_idx]
+        NBmag[NB_idx]   = NB_catdata[filt+'_MAG'][cat_idx]
+        contmag[NB_idx] = NB_catdata[filt+'_CONT_MAG'][cat_idx]
 
         logMstar[NB_idx] = NB_tab['stlr_mass'][NB_idx]
         Ha_SFR[NB_idx]   = NB_tab['met_dep_sfr'][NB_idx]
         Ha_Lum[NB_idx]   = NB_tab['obs_lumin'][NB_idx] + \
-            (NII_Ha_corr + filt_corr)[NB_idx]
+            (t_NII_corr + t_filt_corr)
 
         with_spec = np.where((zspec0[NB_idx] > 0) & (zspec0[NB_idx] < 9))[0]
         with_spec = NB_idx[with_spec]
@@ -211,13 +241,25 @@ def get_EW_Flux_distribution():
 
         out_npz = join(path0, 'Completeness', 'ew_flux_Ha-'+filt+'.npz')
         log.info("Writing : "+out_npz)
-        np.savez(out_npz, NB_ID=NB_catdata['ID'][NB_idx], NB_EW=NB_EW[NB_idx],
+        np.savez(out_npz, NB_ID=NB_catdata['ID'][cat_idx], NB_EW=NB_EW[NB_idx],
                  NB_Flux=NB_Flux[NB_idx], Ha_EW=Ha_EW[NB_idx],
                  Ha_Flux=Ha_Flux[NB_idx], NBmag=NBmag[NB_idx],
                  contmag=contmag[NB_idx], spec_flag=spec_flag[NB_idx],
                  logMstar=logMstar[NB_idx], Ha_SFR=Ha_SFR[NB_idx],
                  Ha_Lum=Ha_Lum[NB_idx])
 
+    # Files were rewritten, so drop arrays cached by get_mact_data
+    clear_mact_cache()
+
+
+def read_MAG_APER(NB_phot_file):
+    """
+    Read aperture magnitudes (col #13) from a SExtractor catalog.  Only this
+    column is parsed, with np.loadtxt rather than asc.read of the full table
+    """
+
+    return np.loadtxt(NB_phot_file, usecols=12)
+
 
 def NB_numbers():
     """
@@ -241,23 +283,28 @@ def NB_numbers():
     N_norm0 = []
     mag_arr = []
 
+    MAG_APER_list = []
+    for NB_phot_file in NB_phot_files:
+        print('Reading : '+NB_phot_file)
+        MAG_APER_list.append(read_MAG_APER(NB_phot_file))
+
     ctype = ['blue', 'green', 'black', 'red', 'magenta']
-    for ff in range(len(filters)):
-        print('Reading : '+NB_phot_files[ff])
-        phot_tab = asc.read(NB_phot_files[ff])
-        MAG_APER = phot_tab['col13'].data
+    for ff, MAG_APER in enumerate(MAG_APER_list):
+        # Bin once, then draw both histograms from the counts
+        N, m_bins = np.histogram(MAG_APER, bins=bins)
 
         row = int(ff / 2)
         col = ff % 2
 
         ax = ax_arr[row][col]
 
-        ax0.hist(MAG_APER, bins=bins, align='mid', color=ctype[ff],
-                 linestyle='solid', histtype='step', label=filters[ff])
+        ax0.hist(m_bins[:-1], bins=m_bins, weights=N, align='mid',
+                 color=ctype[ff], linestyle='solid', histtype='step',
+                 label=filters[ff])
 
-        N, m_bins, _ = ax.hist(MAG_APER, bins=bins, align='mid', color='black',
-                               linestyle='solid', histtype='step',
-                               label='N = '+str(len(MAG_APER)))
+        ax.hist(m_bins[:-1], bins=m_bins, weights=N, align='mid',
+                color='black', linestyle='solid', histtype='step',
+                label='N = '+str(len(MAG_APER)))
 
         det0  = np.where((m_bins >= 18.0) & (m_bins <= m_NB[ff]))[0]
         p_fit = np.polyfit(m_bins[det0], np.log10(N[det0]), 1)
@@ -308,6 +355,9 @@ def NB_numbers():
                         wspace=0.025, hspace=0.025)
     fig0.savefig(out_pdf0, bbox_inches='tight')
 
+    # Per-filter bins differ in length, so store them concatenated with the
+    # number of bins for each filter rather than as a pickled object array
     out_npz = out_pdf.replace('.pdf', '.npz')
     np.savez(out_npz, filters=filters, bin_size=bin_size, NB_slope0=NB_slope0,
-             mag_arr=mag_arr, N_norm0=N_norm0)
+             mag_arr=np.concatenate(mag_arr), N_norm0=np.concatenate(N_norm0),
+             N_bins=[len(arr) for arr in mag_arr])
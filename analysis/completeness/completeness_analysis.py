@@ -7,10 +7,11 @@ in the M*-SFR plot
 """
 
 from os import mkdir
+from multiprocessing import Pool
 
 from chun_codes import TimerClass
 
-from os.path import exists, join
+from os.path import exists, join, split
 
 from astropy.table import Table, vstack
 
@@ -20,8 +21,6 @@ import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
 from mpl_toolkits.axes_grid1.inset_locator import inset_axes
 
-from scipy.interpolate import interp1d
-
 from . import MLog, get_date  # for logging
 from . import filter_dict  # For EW and flux calculations
 
@@ -39,16 +38,17 @@ from .config import path0, npz_path0
 
 # Import separate functions
 from .config import pdf_filename
-from .stats import stats_log, avg_sig_label, stats_plot, compute_weighted_dispersion, lowM_cutoff_sigma
-from .monte_carlo import random_mags
+from .stats import stats_log, avg_sig, avg_sig_label, stats_plot, compute_weighted_dispersion, lowM_cutoff_sigma
+from .monte_carlo import random_mags, EW_grid_draws, load_MC_files
 from .monte_carlo import main as mc_main
 from .select import color_cut, get_EW
 from .dataset import get_mact_data
 from .plotting import avg_sig_plot_init, plot_MACT, plot_mock, plot_completeness
 from .plotting import overlay_mock_average_dispersion, plot_dispersion, ew_flux_hist
-from .properties import get_mag_vs_mass_interp, compute_EW
+from .plotting import hist_counts, plot_avg_sig_models
+from .properties import get_mag_vs_mass_interp, compute_EW, mass_scatter_draws
 from .normalization import get_normalization
-from .pdf_plot_merge import run_merge_final_plots, merge_final_plots
+from .pdf_plot_merge import run_merge_final_plots, merge_final_plots, merge_avg_sigma_plots
 from .paper_plots_tables import make_table as make_completeness_table
 from .paper_plots_tables import make_plots
 
@@ -57,163 +57,299 @@ from astropy.cosmology import FlatLambdaCDM
 
 cosmo = FlatLambdaCDM(H0=70 * u.km / u.s / u.Mpc, Om0=0.3)
 
+# Luminosity distance [cm] for each NB filter
+lum_dist_NB = cosmo.luminosity_distance(z_NB).to(u.cm).value
+
 if not exists(npz_path0):
     mkdir(npz_path0)
 
 
-def plot_NB_select(ff, t_ax, NB, ctype, linewidth=1, plot4=True):
-    t_ax.axhline(y=minthres[ff], linestyle='dashed', color=ctype)
-
-    y3 = color_cut(NB, m_NB[ff], cont_lim[ff])
-    t_ax.plot(NB, y3, ctype + '--', linewidth=linewidth)
-
-    y3_int = interp1d(y3, NB)
-    NB_break = y3_int(minthres[ff])
-
-    if plot4:
-        y4 = color_cut(NB, m_NB[ff], cont_lim[ff], sigma=4.0)
-        t_ax.plot(NB, y4, ctype + ':', linewidth=linewidth)
-
-    return NB_break
-
-
-def ew_MC(date_folder='', Nsim=5000., Nmock=10, debug=False, redo=False, run_filt=''):
+def get_NB_select_lines(ff, NB):
     """
-    Main function for Monte Carlo realization.  Adopts log-normal
-    EW distribution to determine survey sensitivity and impact on
-    M*-SFR relation
+    Purpose:
+      Compute 3- and 4-sigma NB excess selection curves and the NB magnitude
+      where the 3-sigma curve crosses the minimum NB excess color
 
-    Parameters
-    ----------
-    date_folder : relative sub-folder in "Completeness"
-      Recommended format: 3-char month and two-digit date. e.g., "sep15"
-    Nsim: Number of modelled galaxies (int)
-    Nmock: Number of mock galaxies for each modelled galaxy (int)
-    debug : boolean
-      If enabled, a quicker version is executed for test-driven development.
-      Default: False
-    redo : boolean
-      Re-run mock galaxy generation even if file exists. Default: False
-    run_filt : str
-      Run specific simulations for a selected filter. Default: run alls
-      Options: 'NB704', 'NB711', 'NB816', 'NB921', 'NB973'
-    """
+    :param ff: integer for filter
+    :param NB: numpy array of NB magnitudes
 
-    MC_folder_path = join(path0, "Completeness", date_folder)
-    if not exists(MC_folder_path):
-        mkdir(MC_folder_path)
+    :return NB_lines: dictionary containing 'y3', 'y4', and 'NB_break'
+    """
 
-    str_date = get_date(debug=debug)
-    mylog = MLog(MC_folder_path, str_date)._get_logger()
+    y3 = color_cut(NB, m_NB[ff], cont_lim[ff])
+    y4 = color_cut(NB, m_NB[ff], cont_lim[ff], sigma=4.0)
 
-    t0 = TimerClass()
-    t0._start()
+    # y3 increases with NB so it can be inverted directly
+    finite = np.isfinite(y3)
+    NB_break = np.interp(minthres[ff], y3[finite], NB[finite])
 
-    mylog.info('Nsim : ', Nsim)
+    NB_lines = {'y3': y3, 'y4': y4, 'NB_break': NB_break}
+    return NB_lines
 
-    nrow_stats = 4
 
-    # One file written for all avg and sigma comparisons
-    if not debug and not run_filt:
-        out_pdf3 = join(MC_folder_path, 'ew_MC.avg_sigma.pdf')
-        pp3 = PdfPages(out_pdf3)
-    else:
-        mylog.info("Will not write consolidated avg_sigma plots")
+def plot_NB_select(ff, t_ax, NB, ctype, linewidth=1, plot4=True, NB_lines=None):
+    if NB_lines is None:
+        NB_lines = get_NB_select_lines(ff, NB)
 
-    # Set filters to run simulations
-    if not run_filt:
-        ff_range = [0] if debug else range(len(filters))
-        if debug:
-            mylog.info('Running: debug simulation')
-        else:
-            mylog.info('Running: all simulations')
-    else:
-        mylog.info('Running: '+run_filt+' simulations')
-        ff_range = [xx for xx in range(len(filters)) if filters[xx] == run_filt]
+    t_ax.axhline(y=minthres[ff], linestyle='dashed', color=ctype)
 
-    mm_range = [0] if debug else range(n_mean)
-    ss_range = [0] if debug else range(n_sigma)
+    t_ax.plot(NB, NB_lines['y3'], ctype + '--', linewidth=linewidth)
 
-    for ff in ff_range:  # loop over filter
-        t_ff = TimerClass()
-        t_ff._start()
-        mylog.info("Working on : " + filters[ff])
+    if plot4:
+        t_ax.plot(NB, NB_lines['y4'], ctype + ':', linewidth=linewidth)
 
-        logEW_mean = logEW_mean_start[ff] + 0.1 * np.arange(n_mean)
-        logEW_sig = logEW_sig_start[ff] + 0.1 * np.arange(n_sigma)
+    return NB_lines['NB_break']
 
-        mylog.info("logEW_mean : {0}".format(logEW_mean))
-        mylog.info("logEW_sig : {0}".format(logEW_sig))
 
-        comp_shape = (len(mm_range), len(ss_range))
-        comp_sSFR = np.zeros(comp_shape)
-        # comp_EW   = np.zeros(comp_shape)
-        comp_SFR = np.zeros(comp_shape)
-        comp_flux = np.zeros(comp_shape)
-        comp_EWmean = np.zeros(comp_shape)
-        comp_EWsig = np.zeros(comp_shape)
+# Read-only inputs shared by all EW models of a filter.  Set once per
+# process by _init_mc_model so they are not pickled for each model
+_mc_state = dict()
 
-        pdf_dict = pdf_filename(ff, date_folder=date_folder, debug=debug)
 
-        pp = PdfPages(pdf_dict['main'])    # Main plots
-        pp0 = PdfPages(pdf_dict['crop'])   # Contains cropped plots
-        pp2 = PdfPages(pdf_dict['stats'])  # This contains stats plots
-        pp4 = PdfPages(pdf_dict['comp'])   # Completeness plots
+def _init_mc_model(mc_state):
+    """
+    Pool initializer for _run_mc_model.  Interpolation functions are
+    closures, so they are rebuilt here rather than passed to the process.
+    Loggers are pickled by name, so with the spawn start method the filter
+    logger is set up again with handlers for the same log file
+    """
 
-        filt_dict = {'dNB': filter_dict['dNB'][ff],
-                     'dBB': filter_dict['dBB'][ff],
-                     'lambdac': filter_dict['lambdac'][ff]}
+    _mc_state.update(mc_state)
+    mylog = mc_state['mylog']
+    if not getattr(mylog, 'handler_set', None):
+        log_dir, log_file = split(mylog.name)
+        _mc_state['mylog'] = MLog(log_dir, '',
+                                  prefix=log_file[:-len('.log')])._get_logger()
+    mass_int, std_mass_int = get_mag_vs_mass_interp(prefixes[mc_state['ff']])
+    _mc_state['mass_dict'] = {'mass_int': mass_int,
+                              'std_mass_int': std_mass_int}
 
-        # Retrieve EW interpolated grid
-        EW_int = get_EW(ff, mylog)
 
-        NBmin = 20.0
-        NBmax = m_NB[ff] - 0.25
-        NB = np.arange(NBmin, NBmax + NB_bin, NB_bin)
-        mylog.info('NB (min/max): %f %f ' % (min(NB), max(NB)))
+def _run_mc_model(mc_args):
+    """
+    Run monte_carlo.main for a single (mm, ss) EW model using _mc_state
 
-        # Get number distribution for normalization
-        norm_dict = get_normalization(ff, Nmock, NB, Nsim, NB_bin, mylog, redo=redo)
+    :param mc_args: tuple of mm, ss, and npz_MCdict (None if not preloaded)
+    """
 
-        mock_sz = (Nmock, norm_dict['Ngal'])
+    mm, ss, npz_MCdict = mc_args
+    int_dict = {'ff': _mc_state['ff'], 'mm': mm, 'ss': ss}
 
-        # Randomize NB magnitudes. First get relative sigma, then scale by size
-        NB_seed = ff
-        mylog.info("seed for %s : %i" % (filters[ff], NB_seed))
-        NB_MC = random_mags(NB_seed, mock_sz, norm_dict['NB_ref'],
-                            norm_dict['NB_sig_ref'])
-        stats_log(NB_MC, "NB_MC", mylog)
+    return mc_main(int_dict, _mc_state['npz_MCfiles'][(mm, ss)],
+                   _mc_state['mock_sz'], _mc_state['ss_range'],
+                   _mc_state['mass_dict'], _mc_state['norm_dict'],
+                   _mc_state['filt_dict'], _mc_state['EW_dict'],
+                   _mc_state['NB_MC'], _mc_state['lum_dist'],
+                   _mc_state['mylog'], redo=_mc_state['redo'],
+                   sig_limit_MC=_mc_state['sig_limit_MC'],
+                   MC_buf=_mc_state['MC_buf'], npz_MCdict=npz_MCdict)
 
-        # Read in mag vs mass extrapolation
-        mass_int, std_mass_int = get_mag_vs_mass_interp(prefixes[ff])
 
-        lum_dist = cosmo.luminosity_distance(z_NB[ff]).to(u.cm).value
+def ew_MC_filter(ff, MC_folder_path, date_folder='', Nsim=5000, Nmock=10,
+                 debug=False, redo=False, mylog=None, n_jobs=1):
+    """
+    Monte Carlo realization for a single filter, looping over all
+    log-normal EW distribution models.  Called by ew_MC()
 
-        # Read in EW and fluxes for H-alpha NB emitter sample
-        dict_NB = get_mact_data(ff)
+    Parameters
+    ----------
+    ff : int
+      Index for filter
+    MC_folder_path : str
+      Full path for "Completeness" sub-folder
+    date_folder : relative sub-folder in "Completeness"
+    Nsim: Number of modelled galaxies (int)
+    Nmock: Number of mock galaxies for each modelled galaxy (int)
+    debug : boolean
+      If enabled, a quicker version is executed. Default: False
+    redo : boolean
+      Re-run mock galaxy generation even if file exists. Default: False
+    mylog : logging object
+      Default: A separate log file for this filter is used
+    n_jobs : int
+      Number of processes to run EW models in parallel. Plotting is
+      done in this process in model order. Default: 1 (serial)
+
+    Returns
+    -------
+    result : dict
+      'comp_tab': astropy table of completeness for all models
+      'best_tab': astropy table row of the best fit. None if debug
+      'avg_sigma_pdf': filename of avg_sigma plot
+    """
 
-        # Statistics for comparisons
-        avg_NB = np.average(dict_NB['NB_EW'])
-        sig_NB = np.std(dict_NB['NB_EW'])
+    if mylog is None:
+        str_date = get_date(debug=debug)
+        log_prefix = 'completeness_analysis.' + filters[ff] + '.'
+        mylog = MLog(MC_folder_path, str_date, prefix=log_prefix)._get_logger()
 
-        avg_NB_flux = np.average(dict_NB['Ha_Flux'])
-        sig_NB_flux = np.std(dict_NB['Ha_Flux'])
+    nrow_stats = 4
 
-        # Plot sigma and average
-        fig3, ax3 = avg_sig_plot_init(filters[ff], logEW_mean, avg_NB, sig_NB,
-                                      avg_NB_flux, sig_NB_flux)
-        ax3ul = ax3[0][0]
-        ax3ll = ax3[1][0]
-        ax3ur = ax3[0][1]
-        ax3lr = ax3[1][1]
+    mm_range = [0] if debug else range(n_mean)
+    ss_range = [0] if debug else range(n_sigma)
 
-        # Compute low-mass cutoff for each filter
-        lowM_cutoff = lowM_cutoff_sigma(dict_NB['logMstar'])
-        mylog.info("lowM_cutoff: %.2f" % lowM_cutoff)
+    t_ff = TimerClass()
+    t_ff._start()
+    mylog.info("Working on : " + filters[ff])
+
+    logEW_mean = logEW_mean_start[ff] + 0.1 * np.arange(n_mean)
+    logEW_sig = logEW_sig_start[ff] + 0.1 * np.arange(n_sigma)
+
+    mylog.info("logEW_mean : {0}".format(logEW_mean))
+    mylog.info("logEW_sig : {0}".format(logEW_sig))
 
-        chi2_EW0 = np.zeros(comp_shape)
-        chi2_Fl0 = np.zeros(comp_shape)
+    comp_shape = (len(mm_range), len(ss_range))
+
+    # x-axis positions of each (mm, ss) model on the avg_sigma plots
+    EW_xoff = logEW_mean[:len(mm_range), None] + \
+        0.005 * (np.arange(len(ss_range)) - 3 / 2.)
+
+    comp_sSFR = np.zeros(comp_shape)
+    # comp_EW   = np.zeros(comp_shape)
+    comp_SFR = np.zeros(comp_shape)
+    comp_flux = np.zeros(comp_shape)
+    comp_EWmean = np.zeros(comp_shape)
+    comp_EWsig = np.zeros(comp_shape)
+
+    pdf_dict = pdf_filename(ff, date_folder=date_folder, debug=debug)
+
+    pp = PdfPages(pdf_dict['main'])    # Main plots
+    pp0 = PdfPages(pdf_dict['crop'])   # Contains cropped plots
+    pp2 = PdfPages(pdf_dict['stats'])  # This contains stats plots
+    pp4 = PdfPages(pdf_dict['comp'])   # Completeness plots
+
+    filt_dict = {'dNB': filter_dict['dNB'][ff],
+                 'dBB': filter_dict['dBB'][ff],
+                 'lambdac': filter_dict['lambdac'][ff]}
+
+    # Retrieve EW interpolated grid
+    EW_int = get_EW(ff, mylog)
+
+    NBmin = 20.0
+    NBmax = m_NB[ff] - 0.25
+    NB = np.arange(NBmin, NBmax + NB_bin, NB_bin)
+    mylog.info('NB (min/max): %f %f ' % (min(NB), max(NB)))
+
+    # Selection curves are the same for all models
+    NB_lines = get_NB_select_lines(ff, NB)
+
+    # Get number distribution for normalization
+    norm_dict = get_normalization(ff, Nmock, NB, Nsim, NB_bin, mylog, redo=redo)
+
+    mock_sz = (Nmock, norm_dict['Ngal'])
+
+    # Randomize NB magnitudes. First get relative sigma, then scale by size
+    NB_seed = ff
+    mylog.info("seed for %s : %i" % (filters[ff], NB_seed))
+    NB_MC = random_mags(NB_seed, mock_sz, norm_dict['NB_ref'],
+                        norm_dict['NB_sig_ref'])
+    stats_log(NB_MC, "NB_MC", mylog)
+
+    # NB_MC and NB_ref are the same for all models so compute selection
+    # limits once.  NB_ref repeats each NB bin Ndist_mock times, so its
+    # limit is computed for the first galaxy of each bin and repeated
+    sig_limit_MC = color_cut(NB_MC, m_NB[ff], cont_lim[ff])
+    N_rep = norm_dict['Ndist_mock'][norm_dict['Ndist_mock'] > 0]
+    NB_first = norm_dict['NB_ref'][np.cumsum(N_rep) - N_rep]
+    norm_dict['sig_limit_ref'] = np.repeat(color_cut(NB_first, m_NB[ff],
+                                                     cont_lim[ff]), N_rep)
+    above_break = NB_MC <= NB_lines['NB_break']
+
+    lum_dist = lum_dist_NB[ff]
+
+    # EW at the minimum NB excess color for selection
+    min_EW = compute_EW(minthres[ff], ff)
+    mylog.info("minimum EW : %f " % min_EW)
+
+    # Read in EW and fluxes for H-alpha NB emitter sample
+    dict_NB = get_mact_data(ff)
+
+    # Statistics for comparisons
+    avg_NB, sig_NB = avg_sig(dict_NB['NB_EW'])
+    avg_NB_flux, sig_NB_flux = avg_sig(dict_NB['Ha_Flux'])
+
+    # Histograms of NB emitter sample for model comparisons
+    No_EW = hist_counts(dict_NB['NB_EW'], EW_bins)
+    No_Flux = hist_counts(dict_NB['Ha_Flux'], Flux_bins)
+
+    # NB excess and sSFR of the NB emitter sample, and plot settings, are
+    # the same for all models
+    NB_excess_NB = dict_NB['contmag'] - dict_NB['NBmag']
+    logsSFR_NB = dict_NB['Ha_SFR'] - dict_NB['logMstar']
+
+    NB_limit = [20.0, max(NB)+1]
+    ylabel_excess = cont0[ff] + ' - ' + filters[ff]
+    cticks = np.arange(0, 1.2, 0.2)
+
+    # Plot sigma and average
+    fig3, ax3 = avg_sig_plot_init(filters[ff], logEW_mean, avg_NB, sig_NB,
+                                  avg_NB_flux, sig_NB_flux)
+    ax3ul = ax3[0][0]
+    ax3ll = ax3[1][0]
+    ax3ur = ax3[0][1]
+    ax3lr = ax3[1][1]
+
+    # Compute low-mass cutoff for each filter
+    lowM_cutoff = lowM_cutoff_sigma(dict_NB['logMstar'])
+    mylog.info("lowM_cutoff: %.2f" % lowM_cutoff)
+
+    chi2_EW0 = np.zeros(comp_shape)
+    chi2_Fl0 = np.zeros(comp_shape)
+    has_sel0 = np.zeros(comp_shape, dtype=bool)
+
+    # Average and dispersion of selected mock galaxies for avg_sigma plot
+    avg_EW_gd = np.full(comp_shape, np.nan)
+    sig_EW_gd = np.full(comp_shape, np.nan)
+    avg_Fl_gd = np.full(comp_shape, np.nan)
+    sig_Fl_gd = np.full(comp_shape, np.nan)
+
+    # Draw EWs and NB excess colors for all models at once
+    logEW_MC_ref, x_MC0_ref = EW_grid_draws(mm_range, ss_range, logEW_mean,
+                                            logEW_sig, norm_dict['Ngal'],
+                                            EW_int)
+    EW_dict = {'logEW_mean': logEW_mean, 'logEW_sig': logEW_sig,
+               'logEW_MC_ref': logEW_MC_ref, 'x_MC0_ref': x_MC0_ref}
+
+    # Mocked arrays are only needed within a model, so allocate them once.
+    # The logM scatter draws use a fixed seed, so they are drawn once
+    MC_buf = {'BB_MC': np.empty(mock_sz, dtype=np.float32),
+              'x_MC': np.empty(mock_sz, dtype=np.float32),
+              'EW_flag0': np.zeros(mock_sz, dtype=np.uint8),
+              'rand_logM': mass_scatter_draws(mock_sz)}
+
+    npz_MCfiles = {(mm, ss): npz_path0 + filters[ff] +
+                   ('_%.2f_%.2f.npz') % (logEW_mean[mm], logEW_sig[ss])
+                   for mm in mm_range for ss in ss_range}
+
+    # Read all models from an earlier run once, before the model loop
+    npz_MCpreload = dict() if redo else load_MC_files(npz_MCfiles)
+
+    mc_state = {'ff': ff, 'npz_MCfiles': npz_MCfiles, 'mock_sz': mock_sz,
+                'ss_range': ss_range, 'norm_dict': norm_dict,
+                'filt_dict': filt_dict, 'EW_dict': EW_dict, 'NB_MC': NB_MC,
+                'lum_dist': lum_dist, 'mylog': mylog, 'redo': redo,
+                'sig_limit_MC': sig_limit_MC, 'MC_buf': MC_buf}
+    mc_args = [(mm, ss, npz_MCpreload.pop((mm, ss), None))
+               for mm in mm_range for ss in ss_range]
+
+    # Single-panel crop figure and SFR/sSFR figure are cleared and redrawn
+    # for each model page
+    fig0, ax0 = plt.subplots()
+    fig5, ax5 = plt.subplots(nrows=2, ncols=2)
+
+    # EW models are independent. Mag vs mass extrapolation is read in by
+    # _init_mc_model. Results are returned in model order
+    if n_jobs > 1:
+        pool = Pool(processes=n_jobs, initializer=_init_mc_model,
+                    initargs=(mc_state,))
+        mc_results = pool.imap(_run_mc_model, mc_args)
+        pool.close()
+    else:
+        _init_mc_model(mc_state)
+        mc_results = map(_run_mc_model, mc_args)
 
+    # Workers are stopped even if a plotting call raises
+    try:
         count = 0
         for mm in mm_range:  # loop over median of EW dist
             comp_EWmean[mm] = logEW_mean[mm]
@@ -221,8 +357,7 @@ def ew_MC(date_folder='', Nsim=5000., Nmock=10, debug=False, redo=False, run_fil
                 comp_EWsig[mm, ss] = logEW_sig[ss]
                 mylog.info("EW model: {0} {1}".format(logEW_mean[mm], logEW_sig[ss]))
 
-                npz_MCfile = npz_path0 + filters[ff] + ('_%.2f_%.2f.npz') % (logEW_mean[mm],
-                                                                             logEW_sig[ss])
+                npz_MCfile = npz_MCfiles[(mm, ss)]
 
                 fig, ax = plt.subplots(ncols=2, nrows=3)
                 [[ax00, ax01], [ax10, ax11], [ax20, ax21]] = ax
@@ -235,29 +370,18 @@ def ew_MC(date_folder='', Nsim=5000., Nmock=10, debug=False, redo=False, run_fil
                     fig2, ax2 = plt.subplots(ncols=2, nrows=nrow_stats)
                 s_row = count % nrow_stats  # For statistics plot
 
-                int_dict = {'ff': ff, 'mm': mm, 'ss': ss}
-                mass_dict = {'mass_int': mass_int, 'std_mass_int': std_mass_int}
-                EW_dict = {'logEW_mean': logEW_mean, 'logEW_sig': logEW_sig,
-                           'EW_int': EW_int}
-
                 dict_phot_ref, der_prop_dict_ref, npz_MCdict, \
-                    dict_MC = mc_main(int_dict, npz_MCfile, mock_sz, ss_range,
-                                      mass_dict, norm_dict, filt_dict, EW_dict,
-                                      NB_MC, lum_dist, mylog, redo=redo)
+                    dict_MC = next(mc_results)
 
                 # Panel (0,0) - NB excess selection plot
-                NB_limit = [20.0, max(NB)+1]
-
-                ylabel_excess = cont0[ff] + ' - ' + filters[ff]
                 plot_mock(ax00, dict_MC, 'NB', 'x', x_limit=NB_limit,
                           ylabel=ylabel_excess)
 
                 ax00.axvline(m_NB[ff], linestyle='dashed', color='b')
 
-                temp_x = dict_NB['contmag'] - dict_NB['NBmag']
-                plot_MACT(ax00, dict_NB, 'NBmag', temp_x)
+                plot_MACT(ax00, dict_NB, 'NBmag', NB_excess_NB)
 
-                NB_break = plot_NB_select(ff, ax00, NB, 'b')
+                plot_NB_select(ff, ax00, NB, 'b', NB_lines=NB_lines)
 
                 N_annot_txt = avg_sig_label('', logEW_mean[mm], logEW_sig[ss],
                                             panel_type='EW')
@@ -266,25 +390,21 @@ def ew_MC(date_folder='', Nsim=5000., Nmock=10, debug=False, redo=False, run_fil
                               ha='left', xycoords='axes fraction')
 
                 # Plot cropped version
-                fig0, ax0 = plt.subplots()
-                plt.subplots_adjust(left=0.1, right=0.98, bottom=0.10,
-                                    top=0.98, wspace=0.25, hspace=0.05)
+                ax0.cla()
+                fig0.subplots_adjust(left=0.1, right=0.98, bottom=0.10,
+                                     top=0.98, wspace=0.25, hspace=0.05)
 
                 plot_mock(ax0, dict_MC, 'NB', 'x', x_limit=NB_limit,
                           xlabel=filters[ff], ylabel=ylabel_excess)
                 ax0.axvline(m_NB[ff], linestyle='dashed', color='b')
 
-                temp_x = dict_NB['contmag'] - dict_NB['NBmag']
-                plot_MACT(ax0, dict_NB, 'NBmag', temp_x)
+                plot_MACT(ax0, dict_NB, 'NBmag', NB_excess_NB)
 
-                plot_NB_select(ff, ax0, NB, 'b', plot4=False)
+                plot_NB_select(ff, ax0, NB, 'b', plot4=False, NB_lines=NB_lines)
 
-                N_annot_txt = avg_sig_label('', logEW_mean[mm], logEW_sig[ss],
-                                            panel_type='EW')
-                N_annot_txt += '\n' + r'$N$ = %i' % NB_MC.size
                 ax0.annotate(N_annot_txt, [0.025, 0.975], va='top',
                              ha='left', xycoords='axes fraction')
-                fig0.savefig(pp0, format='pdf')
+                pp0.savefig(fig0)
 
                 # Panel (1,0) - NB mag vs H-alpha flux
                 plot_mock(ax10, dict_MC, 'NB', 'Ha_Flux', x_limit=NB_limit,
@@ -307,51 +427,54 @@ def ew_MC(date_folder='', Nsim=5000., Nmock=10, debug=False, redo=False, run_fil
                 plot_MACT(ax11, dict_NB, 'logMstar', 'Ha_SFR')
 
                 # Plot cropped version
-                fig0, ax0 = plt.subplots()
-                plt.subplots_adjust(left=0.1, right=0.98, bottom=0.10,
-                                    top=0.98, wspace=0.25, hspace=0.05)
+                ax0.cla()
+                fig0.subplots_adjust(left=0.1, right=0.98, bottom=0.10,
+                                     top=0.98, wspace=0.25, hspace=0.05)
 
                 plot_mock(ax0, dict_MC, 'logM', 'logSFR', xlabel=M_lab,
                           ylabel=SFR_lab)
 
                 plot_MACT(ax0, dict_NB, 'logMstar', 'Ha_SFR')
                 # ax0.set_ylim([-5,-1])
-                fig0.savefig(pp0, format='pdf')
+                pp0.savefig(fig0)
 
                 # Panel (2,0) - histogram of EW
-                min_EW = compute_EW(minthres[ff], ff)
-                mylog.info("minimum EW : %f " % min_EW)
                 ax20.axvline(x=min_EW, color='red')
 
-                No, Ng, binso, \
-                    wht0 = ew_flux_hist('EW', mm, ss, ax20, dict_NB['NB_EW'], avg_NB,
-                                        sig_NB, EW_bins, logEW_mean, logEW_sig,
-                                        dict_MC['EW_flag0'], dict_MC['logEW'], ax3=ax3ul)
+                No, Ng, binso, avg_gd, \
+                    sig_gd = ew_flux_hist('EW', ax20, dict_NB['NB_EW'], avg_NB,
+                                          sig_NB, EW_bins, dict_MC['EW_flag0'],
+                                          dict_MC['logEW'], No=No_EW)
                 ax20.set_position([0.085, 0.05, 0.44, 0.265])
+                if avg_gd is not None:
+                    avg_EW_gd[mm, ss], sig_EW_gd[mm, ss] = avg_gd, sig_gd
 
-                good = np.where(dict_MC['EW_flag0'])[0]
+                has_sel = np.any(dict_MC['EW_flag0'])
+                has_sel0[mm, ss] = has_sel
 
                 # Model comparison plots
-                if len(good) > 0:
-                    chi2 = stats_plot('EW', ax2, ax3ur, ax20, s_row, Ng, No,
-                                      binso, logEW_mean[mm], logEW_sig[ss], ss)
+                if has_sel:
+                    chi2 = stats_plot('EW', ax2, ax20, s_row, Ng, No, binso,
+                                      logEW_mean[mm], logEW_sig[ss])
                     chi2_EW0[mm, ss] = chi2
 
                 # Panel (2,1) - histogram of H-alpha fluxes
-                No, Ng, binso, \
-                    wht0 = ew_flux_hist('Flux', mm, ss, ax21, dict_NB['Ha_Flux'],
-                                        avg_NB_flux, sig_NB_flux, Flux_bins,
-                                        logEW_mean, logEW_sig,
-                                        dict_MC['EW_flag0'], dict_MC['Ha_Flux'], ax3=ax3ll)
+                No, Ng, binso, avg_gd, \
+                    sig_gd = ew_flux_hist('Flux', ax21, dict_NB['Ha_Flux'],
+                                          avg_NB_flux, sig_NB_flux, Flux_bins,
+                                          dict_MC['EW_flag0'], dict_MC['Ha_Flux'],
+                                          No=No_Flux)
                 ax21.set_position([0.53, 0.05, 0.44, 0.265])
+                if avg_gd is not None:
+                    avg_Fl_gd[mm, ss], sig_Fl_gd[mm, ss] = avg_gd, sig_gd
 
                 ax21.legend(loc='upper right', fancybox=True, fontsize=6,
                             framealpha=0.75)
 
                 # Model comparison plots
-                if len(good) > 0:
-                    chi2 = stats_plot('Flux', ax2, ax3lr, ax21, s_row, Ng, No,
-                                      binso, logEW_mean[mm], logEW_sig[ss], ss)
+                if has_sel:
+                    chi2 = stats_plot('Flux', ax2, ax21, s_row, Ng, No, binso,
+                                      logEW_mean[mm], logEW_sig[ss])
                     chi2_Fl0[mm, ss] = chi2
 
                 if s_row != nrow_stats - 1:
@@ -363,7 +486,7 @@ def ew_MC(date_folder='', Nsim=5000., Nmock=10, debug=False, redo=False, run_fil
 
                 # Save each page after each model iteration
                 fig.set_size_inches(8, 10)
-                fig.savefig(pp, format='pdf')
+                pp.savefig(fig)
                 plt.close(fig)
 
                 # Save figure for each full page completed
@@ -372,17 +495,15 @@ def ew_MC(date_folder='', Nsim=5000., Nmock=10, debug=False, redo=False, run_fil
                                          top=0.97, wspace=0.13)
 
                     fig2.set_size_inches(8, 10)
-                    fig2.savefig(pp2, format='pdf')
+                    pp2.savefig(fig2)
                     plt.close(fig2)
                 count += 1
 
                 # Compute and plot completeness
                 # Combine over modelled galaxies
-                comp_arr = np.sum(dict_MC['EW_flag0'], axis=0) / float(Nmock)
+                comp_arr = dict_MC['EW_flag0'].mean(axis=0)
 
                 # Plot Type 1 and 2 errors
-                cticks = np.arange(0, 1.2, 0.2)
-
                 fig4, ax4 = plt.subplots(nrows=2, ncols=2)
                 [[ax400, ax401], [ax410, ax411]] = ax4
 
@@ -407,13 +528,13 @@ def ew_MC(date_folder='', Nsim=5000., Nmock=10, debug=False, redo=False, run_fil
                 for idx, cmap, ins, lab in zip(idx0, cmap0, [ax4ins0, ax4ins1], lab0):
                     cs = ax400.scatter(norm_dict['NB_ref'][idx], dict_phot_ref['x'][idx],
                                        edgecolor='none', vmin=0, vmax=1.0, s=15,
-                                       c=comp_arr[idx], cmap=cmap)
+                                       c=comp_arr[idx], cmap=cmap, rasterized=True)
                     cb = fig4.colorbar(cs, cax=ins, orientation="horizontal",
                                        ticks=cticks)
                     cb.ax.tick_params(labelsize=8)
                     cb.set_label(lab)
 
-                plot_NB_select(ff, ax400, NB, 'k', linewidth=2)
+                plot_NB_select(ff, ax400, NB, 'k', linewidth=2, NB_lines=NB_lines)
 
                 ax400.set_xlabel(filters[ff])
                 ax400.set_ylim([-0.5, 2.0])
@@ -425,8 +546,6 @@ def ew_MC(date_folder='', Nsim=5000., Nmock=10, debug=False, redo=False, run_fil
                 logsSFR_ref = der_prop_dict_ref['logSFR'] - der_prop_dict_ref['logM']
                 logsSFR_MC = dict_MC['logSFR'] - dict_MC['logM']
 
-                above_break = np.where(NB_MC <= NB_break)
-
                 t_comp_sSFR, \
                     t_comp_sSFR_ref = plot_completeness(ax401, dict_MC, logsSFR_MC,
                                                         sSFR_bins, ref_arr0=logsSFR_ref,
@@ -452,22 +571,24 @@ def ew_MC(date_folder='', Nsim=5000., Nmock=10, debug=False, redo=False, run_fil
                 # ax410.axvline(x=compute_EW(minthres[ff], ff), color='red')
 
                 fig4.set_size_inches(8, 8)
-                fig4.savefig(pp4, format='pdf')
+                pp4.savefig(fig4)
+                plt.close(fig4)
 
                 # Plot SFR completeness in crop plots set
-                fig0, ax0 = plt.subplots()
-                plt.subplots_adjust(left=0.1, right=0.97, bottom=0.10,
-                                    top=0.98, wspace=0.25, hspace=0.05)
+                ax0.cla()
+                fig0.subplots_adjust(left=0.1, right=0.97, bottom=0.10,
+                                     top=0.98, wspace=0.25, hspace=0.05)
                 plot_completeness(ax0, dict_MC, 'logSFR', SFR_bins, annotate=False,
                                   ref_arr0=der_prop_dict_ref)
 
                 ax0.set_ylabel('Completeness')
                 ax0.set_xlabel(SFR_lab)
                 ax0.set_ylim([0.0, 1.05])
-                fig0.savefig(pp0, format='pdf')
+                pp0.savefig(fig0)
 
                 # Plot SFR/sSFR vs stellar mass and dispersion
-                fig5, ax5 = plt.subplots(nrows=2, ncols=2)
+                for t_ax in ax5.flat:
+                    t_ax.cla()
 
                 # SFR vs stellar mass
                 plot_mock(ax5[0][0], dict_MC, 'logM', 'logSFR', ylabel=SFR_lab)
@@ -497,86 +618,176 @@ def ew_MC(date_folder='', Nsim=5000., Nmock=10, debug=False, redo=False, run_fil
                 mylog.info("Writing : " + sSFR_bin_MCfile)
                 np.savez(sSFR_bin_MCfile, **sSFR_bin_MC)
 
-                logsSFR = dict_NB['Ha_SFR'] - dict_NB['logMstar']
-                plot_MACT(ax5[0][1], dict_NB, 'logMstar', logsSFR, size=15)
+                plot_MACT(ax5[0][1], dict_NB, 'logMstar', logsSFR_NB, size=15)
 
                 # Dispersion: sSFR vs stellar mass
                 plot_dispersion(ax5[1][1], sSFR_bin_MC)
                 ax5[1][1].tick_params(axis='both', direction='in')
 
-                plt.subplots_adjust(left=0.07, right=0.98, bottom=0.05, top=0.98,
-                                    hspace=0.025)
+                fig5.subplots_adjust(left=0.07, right=0.98, bottom=0.05, top=0.98,
+                                     hspace=0.025)
                 fig5.set_size_inches(8, 8)
-                fig5.savefig(pp4, format='pdf')
-
-        pp.close()
-        pp0.close()
-        pp2.close()
-        pp4.close()
-
-        ax3ul.legend(loc='upper right', title=r'$\sigma[\log({\rm EW})]$',
-                     fancybox=True, fontsize=8, framealpha=0.75, scatterpoints=1)
-
-        # Compute best fit using weighted chi^2
-        chi2_wht = np.sqrt(chi2_EW0 ** 2 / 2 + chi2_Fl0 ** 2 / 2)
-        b_chi2 = np.where(chi2_wht == np.min(chi2_wht))
-        mylog.info("Best chi2 : " + str(b_chi2))
-        mylog.info("Best chi2 : (%s, %s) " % (logEW_mean[b_chi2[0]][0],
-                                              logEW_sig[b_chi2[1]][0]))
-        ax3ur.scatter(logEW_mean[b_chi2[0]] + 0.005 * (b_chi2[1] - 3 / 2.),
-                      chi2_EW0[b_chi2], edgecolor='k', facecolor='none',
-                      s=100, linewidth=2)
-        ax3lr.scatter(logEW_mean[b_chi2[0]] + 0.005 * (b_chi2[1] - 3 / 2.),
-                      chi2_Fl0[b_chi2], edgecolor='k', facecolor='none',
-                      s=100, linewidth=2)
-
-        fig3.set_size_inches(8, 8)
-        fig3.subplots_adjust(left=0.105, right=0.97, bottom=0.065, top=0.98,
-                             wspace=0.25, hspace=0.01)
-
-        out_pdf3_each = join(MC_folder_path, 'ew_MC_' + filters[ff] + '.avg_sigma.pdf')
-        if debug:
-            out_pdf3_each = out_pdf3_each.replace('.pdf', '.debug.pdf')
-        fig3.savefig(out_pdf3_each, format='pdf')
+                pp4.savefig(fig5)
+    finally:
+        if n_jobs > 1:
+            pool.terminate()
+            pool.join()
+        # Release this filter's mock arrays held for the serial path
+        _mc_state.clear()
+
+    plt.close(fig0)
+    plt.close(fig5)
+
+    pp.close()
+    pp0.close()
+    pp2.close()
+    pp4.close()
+
+    # Models where stats_plot had too few bins for chi^2
+    N_few = np.sum(has_sel0 & np.isnan(chi2_EW0)) + \
+        np.sum(has_sel0 & np.isnan(chi2_Fl0))
+    if N_few:
+        mylog.warning("Too few bins in %i panels" % N_few)
+
+    # Draw results of all models on avg_sigma plot
+    plot_avg_sig_models(ax3ul, EW_xoff, logEW_sig, avg_EW_gd, sig_EW_gd,
+                        label=True)
+    plot_avg_sig_models(ax3ll, EW_xoff, logEW_sig, avg_Fl_gd, sig_Fl_gd,
+                        label=True)
+    plot_avg_sig_models(ax3ur, EW_xoff, logEW_sig,
+                        np.where(has_sel0, chi2_EW0, np.nan))
+    plot_avg_sig_models(ax3lr, EW_xoff, logEW_sig,
+                        np.where(has_sel0, chi2_Fl0, np.nan))
+
+    ax3ul.legend(loc='upper right', title=r'$\sigma[\log({\rm EW})]$',
+                 fancybox=True, fontsize=8, framealpha=0.75, scatterpoints=1)
+
+    # Compute best fit using weighted chi^2
+    chi2_wht = np.sqrt(chi2_EW0 ** 2 / 2 + chi2_Fl0 ** 2 / 2)
+    b_chi2 = np.where(chi2_wht == np.min(chi2_wht))
+    mylog.info("Best chi2 : " + str(b_chi2))
+    mylog.info("Best chi2 : (%s, %s) " % (logEW_mean[b_chi2[0]][0],
+                                          logEW_sig[b_chi2[1]][0]))
+    ax3ur.scatter(EW_xoff[b_chi2], chi2_EW0[b_chi2], edgecolor='k',
+                  facecolor='none', s=100, linewidth=2)
+    ax3lr.scatter(EW_xoff[b_chi2], chi2_Fl0[b_chi2], edgecolor='k',
+                  facecolor='none', s=100, linewidth=2)
+
+    fig3.set_size_inches(8, 8)
+    fig3.subplots_adjust(left=0.105, right=0.97, bottom=0.065, top=0.98,
+                         wspace=0.25, hspace=0.01)
+
+    out_pdf3_each = join(MC_folder_path, 'ew_MC_' + filters[ff] + '.avg_sigma.pdf')
+    if debug:
+        out_pdf3_each = out_pdf3_each.replace('.pdf', '.debug.pdf')
+    fig3.savefig(out_pdf3_each, format='pdf')
+
+    plt.close(fig3)
+
+    table_outfile = join(MC_folder_path, filters[ff] + '_completeness_50.tbl')
+    if debug:
+        table_outfile = table_outfile.replace('.tbl', '.debug.tbl')
+    # Flattened (mm, ss) grids are views, so the table shares their memory
+    comp_arr0 = [comp_EWmean.ravel(), comp_EWsig.ravel(), chi2_EW0.ravel(),
+                 chi2_Fl0.ravel(), chi2_wht.ravel(), comp_sSFR.ravel(),
+                 comp_SFR.ravel(), comp_flux.ravel()]
+    c_names = ('log_EWmean', 'log_EWsig', 'chi2_EW', 'chi2_Flux',
+               'chi2_wht', 'comp_50_sSFR', 'comp_50_SFR',
+               'comp_50_flux')
+
+    mylog.info("Writing : " + table_outfile)
+    comp_tab = Table(comp_arr0, names=c_names, copy=False)
+    comp_tab.write(table_outfile, format='ascii.fixed_width_two_line',
+                   overwrite=True)
+
+    # Generate table containing best fit results
+    best_tab0 = None
+    if not debug:
+        best_tab0 = comp_tab[b_chi2[0] * len(ss_range) + b_chi2[1]]
+
+    t_ff._stop()
+    mylog.info("ew_MC completed for " + filters[ff] + " in : " + t_ff.format)
+
+    result = {'comp_tab': comp_tab, 'best_tab': best_tab0,
+              'avg_sigma_pdf': out_pdf3_each}
+    return result
+
+
+def ew_MC(date_folder='', Nsim=5000, Nmock=10, debug=False, redo=False, run_filt='',
+          n_jobs=1):
+    """
+    Main function for Monte Carlo realization.  Adopts log-normal
+    EW distribution to determine survey sensitivity and impact on
+    M*-SFR relation
+
+    Parameters
+    ----------
+    date_folder : relative sub-folder in "Completeness"
+      Recommended format: 3-char month and two-digit date. e.g., "sep15"
+    Nsim: Number of modelled galaxies (int)
+    Nmock: Number of mock galaxies for each modelled galaxy (int)
+    debug : boolean
+      If enabled, a quicker version is executed for test-driven development.
+      Default: False
+    redo : boolean
+      Re-run mock galaxy generation even if file exists. Default: False
+    run_filt : str
+      Run specific simulations for a selected filter. Default: run alls
+      Options: 'NB704', 'NB711', 'NB816', 'NB921', 'NB973'
+    n_jobs : int
+      Number of processes to run filters in parallel. Each process writes
+      to its own log file. For a single filter, EW models are run in
+      parallel instead. Default: 1 (serial)
+    """
+
+    MC_folder_path = join(path0, "Completeness", date_folder)
+    if not exists(MC_folder_path):
+        mkdir(MC_folder_path)
+
+    str_date = get_date(debug=debug)
+    mylog = MLog(MC_folder_path, str_date)._get_logger()
+
+    t0 = TimerClass()
+    t0._start()
 
-        if not debug and not run_filt:
-            fig3.savefig(pp3, format='pdf')
-        plt.close(fig3)
+    mylog.info('Nsim : %i' % Nsim)
 
-        table_outfile = join(MC_folder_path, filters[ff] + '_completeness_50.tbl')
+    # One file written for all avg and sigma comparisons
+    if debug or run_filt:
+        mylog.info("Will not write consolidated avg_sigma plots")
+
+    # Set filters to run simulations
+    if not run_filt:
+        ff_range = [0] if debug else range(len(filters))
         if debug:
-            table_outfile = table_outfile.replace('.tbl', '.debug.tbl')
-        c_size = comp_shape[0] * comp_shape[1]
-        comp_arr0 = [comp_EWmean.reshape(c_size), comp_EWsig.reshape(c_size),
-                     chi2_EW0.reshape(c_size), chi2_Fl0.reshape(c_size),
-                     chi2_wht.reshape(c_size), comp_sSFR.reshape(c_size),
-                     comp_SFR.reshape(c_size), comp_flux.reshape(c_size)]
-        c_names = ('log_EWmean', 'log_EWsig', 'chi2_EW', 'chi2_Flux',
-                   'chi2_wht', 'comp_50_sSFR', 'comp_50_SFR',
-                   'comp_50_flux')
-
-        mylog.info("Writing : " + table_outfile)
-        comp_tab = Table(comp_arr0, names=c_names)
-        comp_tab.write(table_outfile, format='ascii.fixed_width_two_line',
-                       overwrite=True)
-
-        # Generate table containing best fit results
-        if not debug:
-            best_tab0 = comp_tab[b_chi2[0] * len(ss_range) + b_chi2[1]]
-            if not run_filt:
-                if ff == 0:
-                    comp_tab0 = best_tab0
-                else:
-                    comp_tab0 = vstack([comp_tab0, best_tab0])
-            else:
-                comp_tab0 = best_tab0
+            mylog.info('Running: debug simulation')
+        else:
+            mylog.info('Running: all simulations')
+    else:
+        mylog.info('Running: '+run_filt+' simulations')
+        ff_range = [xx for xx in range(len(filters)) if filters[xx] == run_filt]
+
+    # Filters are independent and can be executed in separate processes
+    if n_jobs > 1 and len(ff_range) > 1:
+        args = [(ff, MC_folder_path, date_folder, Nsim, Nmock, debug, redo)
+                for ff in ff_range]
+        with Pool(processes=n_jobs) as pool:
+            results = pool.starmap(ew_MC_filter, args)
+    else:
+        results = [ew_MC_filter(ff, MC_folder_path, date_folder=date_folder,
+                                Nsim=Nsim, Nmock=Nmock, debug=debug,
+                                redo=redo, mylog=mylog, n_jobs=n_jobs)
+                   for ff in ff_range]
 
-        t_ff._stop()
-        mylog.info("ew_MC completed for " + filters[ff] + " in : " + t_ff.format)
+    if not debug:
+        comp_tab0 = vstack([result['best_tab'] for result in results])
 
     if not debug and not run_filt:
         # Save one file for all avg and sigma comparisons
-        pp3.close()
+        out_pdf3 = join(MC_folder_path, 'ew_MC.avg_sigma.pdf')
+        mylog.info("Writing : " + out_pdf3)
+        merge_avg_sigma_plots([result['avg_sigma_pdf'] for result in results],
+                              out_pdf3)
 
         # Write best-fit completeness table
         table_outfile0 = join(MC_folder_path, 'best_fit_completeness_50.tbl')
@@ -584,7 +795,8 @@ def ew_MC(date_folder='', Nsim=5000., Nmock=10, debug=False, redo=False, run_fil
                         overwrite=True)
 
         # Compute weighted intrinsic dispersion
-        compute_weighted_dispersion(table_outfile0, mylog, monte_carlo=True)
+        compute_weighted_dispersion(table_outfile0, mylog, monte_carlo=True,
+                                    n_jobs=n_jobs)
 
         # Merge best-fit plots for each filter
         run_merge_final_plots(MC_folder_path)
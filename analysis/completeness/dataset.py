@@ -1,21 +1,38 @@
 from os.path import join
+from functools import lru_cache
 import numpy as np
 
 from .config import path0, filters
 
 
-def get_mact_data(ff):
-    # Read in EW and fluxes for H-alpha NB emitter sample
-    npz_NB_file = join(path0, 'Completeness/ew_flux_Ha-' + filters[ff] + '.npz')
-    npz_NB = np.load(npz_NB_file)
-
-    dict_NB = dict(npz_NB)
+@lru_cache(maxsize=None)
+def _read_mact_npz(ff):
+    """
+    Read arrays of H-alpha NB emitter sample used for comparisons.
+    Results are cached on ff for the session as the file is read by ew_MC
+    and compute_weighted_dispersion.  get_EW_Flux_distribution clears the
+    cache with clear_mact_cache when it rewrites the files
+    """
 
-    for r_item in ['NB_Flux', 'NB_ID', 'Ha_EW']:
-        dict_NB.pop(r_item)
+    npz_NB_file = join(path0, 'Completeness/ew_flux_Ha-' + filters[ff] + '.npz')
+    with np.load(npz_NB_file) as npz_NB:
+        # NB_Flux, NB_ID, and Ha_EW are not used
+        dict_NB = {name: npz_NB[name] for name in npz_NB.files
+                   if name not in ['NB_Flux', 'NB_ID', 'Ha_EW']}
 
-    spec_flag = npz_NB['spec_flag']
+    spec_flag = dict_NB['spec_flag']
     dict_NB['w_spec'] = np.where(spec_flag)[0]
     dict_NB['wo_spec'] = np.where(spec_flag == 0)[0]
 
     return dict_NB
+
+
+def get_mact_data(ff):
+    # Read in EW and fluxes for H-alpha NB emitter sample.  Arrays are
+    # copied so callers do not modify the cached ones
+    return {name: arr.copy() for name, arr in _read_mact_npz(ff).items()}
+
+
+def clear_mact_cache():
+    # Drop cached arrays after the ew_flux_Ha npz files are rewritten
+    _read_mact_npz.cache_clear()
@@ -17,61 +17,121 @@ npz_MCnames = ['EW_seed', 'logEW_MC_ref', 'x_MC0_ref', 'BB_MC0_ref',
 '''
 
 
-def mock_ones(arr0, Nmock):
+def random_mags(t_seed, rand_shape, mag_ref, sig_ref, out=None,
+                rand_norm=None):
     """
-    Generate (Nmock,Ngal) array using np.ones() to repeat
+    Generate randomized array of magnitudes based on ref values and sigma
+
+    The (Nmock, Ngal) array is filled in place with broadcasting over the
+    Ngal axis so no repeated copies of mag_ref or sig_ref are created.
+    Magnitudes are stored as float32, or in out if a preallocated array of
+    shape rand_shape is provided.  rand_norm are standard normal draws
+    made earlier with t_seed, in which case no new draws are made
     """
 
-    return np.ones((Nmock, 1)) * arr0
+    if rand_norm is None:
+        np.random.seed(t_seed)
+        rand_norm = np.random.normal(size=rand_shape)
+
+    if out is None:
+        mag_MC = rand_norm.astype(np.float32)
+    else:
+        mag_MC = out
+        mag_MC[...] = rand_norm
+    mag_MC *= sig_ref
+    mag_MC += mag_ref
+
+    return mag_MC
 
 
-def random_mags(t_seed, rand_shape, mag_ref, sig_ref):
+def EW_grid_draws(mm_range, ss_range, logEW_mean, logEW_sig, Ngal, EW_int):
     """
-    Generate randomized array of magnitudes based on ref values and sigma
+    Purpose:
+      Draw log-normal EWs for all (mm, ss) models and convert them to NB
+      excess colors with one interpolation call over the full grid
+
+    :param mm_range: indices for logEW_mean
+    :param ss_range: indices for logEW_sig
+    :param logEW_mean: numpy array of log(EW) averages
+    :param logEW_sig: numpy array of log(EW) dispersions
+    :param Ngal: number of modelled galaxies (int)
+    :param EW_int: function mapping log(EW) to NB excess color
+
+    :return logEW_MC_ref: (len(mm_range), len(ss_range), Ngal) array of log(EW)
+    :return x_MC0_ref: (len(mm_range), len(ss_range), Ngal) array of NB excess
     """
 
-    N_rep = rand_shape[0]
+    logEW_MC_ref = np.empty((len(mm_range), len(ss_range), Ngal))
+    for mm in mm_range:
+        for ss in ss_range:
+            # Same seeding as for individual models
+            np.random.seed(mm * len(ss_range) + ss)
+            logEW_MC_ref[mm, ss] = np.random.normal(0.0, 1.0, size=Ngal)
 
-    np.random.seed(t_seed)
-    return mock_ones(mag_ref, N_rep) + np.random.normal(size=rand_shape) * \
-           mock_ones(sig_ref, N_rep)
+    # Randomize based on log-normal EW distribution for Ngal (ref). Not H-alpha EW.
+    # Draws are scaled and shifted in place
+    logEW_MC_ref *= logEW_sig[list(ss_range)][None, :, None]
+    logEW_MC_ref += logEW_mean[list(mm_range)][:, None, None]
+
+    x_MC0_ref = EW_int(logEW_MC_ref).astype(np.float32)  # NB color excess
+
+    return logEW_MC_ref, x_MC0_ref
+
+
+def load_MC_files(npz_MC_files):
+    """
+    Purpose:
+      Read npz_MCnames arrays for models written in an earlier run
+
+    :param npz_MC_files: dictionary of npz file names keyed by (mm, ss)
+
+    :return npz_MCpreload: dictionary of npz_MCdict keyed by (mm, ss) for
+      files that exist
+    """
+
+    npz_MCpreload = dict()
+    for key, npz_MC_file in npz_MC_files.items():
+        if exists(npz_MC_file):
+            with np.load(npz_MC_file) as npz_MC:
+                npz_MCpreload[key] = {name: npz_MC[name] for name in npz_MCnames}
+
+    return npz_MCpreload
 
 
 def main(int_dict, npz_MC_file, mock_sz, ss_range, mass_dict, norm_dict,
-         filt_dict, EW_dict, NB_MC, lum_dist, mylog, redo=False):
+         filt_dict, EW_dict, NB_MC, lum_dist, mylog, redo=False,
+         sig_limit_MC=None, MC_buf=None, npz_MCdict=None):
 
     ff = int_dict['ff']
     mm = int_dict['mm']
     ss = int_dict['ss']
     mass_int = mass_dict['mass_int']
     std_mass_int = mass_dict['std_mass_int']
-    logEW_mean = EW_dict['logEW_mean']
-    logEW_sig = EW_dict['logEW_sig']
-    EW_int = EW_dict['EW_int']
 
-    if not exists(npz_MC_file) or redo:
+    # Preallocated (Nmock, Ngal) arrays reused across models
+    if MC_buf is None:
+        MC_buf = {}
+
+    # npz_MCdict is provided if the model was read by load_MC_files
+    if npz_MCdict is None and (not exists(npz_MC_file) or redo):
         EW_seed = mm * len(ss_range) + ss
         mylog.info("seed for mm=%i ss=%i : %i" % (mm, ss, EW_seed))
-        np.random.seed(EW_seed)
-        rand0 = np.random.normal(0.0, 1.0, size=norm_dict['Ngal'])
 
-        # Randomize based on log-normal EW distribution for Ngal (ref). Not H-alpha EW.
-        logEW_MC_ref = logEW_mean[mm] + logEW_sig[ss] * rand0
+        # Drawn for all models in EW_grid_draws
+        logEW_MC_ref = EW_dict['logEW_MC_ref'][mm, ss]
         stats_log(logEW_MC_ref, "logEW_MC_ref", mylog)
 
-        x_MC0_ref = EW_int(logEW_MC_ref)  # NB color excess
-        negs = np.where(x_MC0_ref < 0)
-        if len(negs[0]) > 0:
-            x_MC0_ref[negs] = 0.0
+        x_MC0_ref = EW_dict['x_MC0_ref'][mm, ss]
+        np.maximum(x_MC0_ref, 0.0, out=x_MC0_ref)
         stats_log(x_MC0_ref, "x_MC0_ref", mylog)
 
         # Selection based on 'true' magnitudes
         NB_sel_ref, NB_nosel_ref, \
-            sig_limit_ref = NB_select(ff, norm_dict['NB_ref'], x_MC0_ref)
+            sig_limit_ref = NB_select(ff, norm_dict['NB_ref'], x_MC0_ref,
+                                      sig_limit=norm_dict.get('sig_limit_ref'))
 
         # Flag array to indicate true galaxies meet selection requirements
-        EW_flag_ref = np.zeros(norm_dict['Ngal'])
-        EW_flag_ref[NB_sel_ref] = 1
+        EW_flag_ref = NB_sel_ref.astype(np.uint8)
 
         # Broad-band magnitudes for input sample
         BB_MC0_ref = norm_dict['NB_ref'] + x_MC0_ref
@@ -81,54 +141,63 @@ def main(int_dict, npz_MC_file, mock_sz, ss_range, mass_dict, norm_dict,
         dict_phot_ref = dict_phot_maker(norm_dict['NB_ref'], BB_MC0_ref,
                                         x_MC0_ref, filt_dict, filt_corr[ff],
                                         mass_int, lum_dist)
-        der_prop_dict_ref = derived_properties(suffix='_ref', **dict_phot_ref)
 
         if exists(npz_MC_file):
             mylog.info("Overwriting : " + npz_MC_file)
         else:
             mylog.info("Writing : " + npz_MC_file)
 
-        npz_MCdict = {}
-        for name in npz_MCnames:
-            npz_MCdict[name] = eval(name)
-        npz_MCdict.update(der_prop_dict_ref)  # Add the derived properties dictionary
+        npz_MCdict = {'EW_seed': EW_seed, 'logEW_MC_ref': logEW_MC_ref,
+                      'x_MC0_ref': x_MC0_ref, 'BB_MC0_ref': BB_MC0_ref,
+                      'BB_sig_ref': BB_sig_ref, 'sig_limit_ref': sig_limit_ref,
+                      'NB_sel_ref': NB_sel_ref, 'NB_nosel_ref': NB_nosel_ref,
+                      'EW_flag_ref': EW_flag_ref}
+        # Derived properties are re-computed from the photometry below, so
+        # only the arrays in npz_MCnames are written
         np.savez(npz_MC_file, **npz_MCdict)
     else:
-        if not redo:
-            mylog.info("File found : " + npz_MC_file)
-            npz_MC = np.load(npz_MC_file)
-
-            npz_MCdict = dict(npz_MC)
-
-            dict_phot_ref = dict_phot_maker(norm_dict['NB_ref'],
-                                            npz_MCdict['BB_MC0_ref'],
-                                            npz_MCdict['x_MC0_ref'],
-                                            filt_dict, filt_corr[ff],
-                                            mass_int, lum_dist)
+        mylog.info("File found : " + npz_MC_file)
+        if npz_MCdict is None:
+            with np.load(npz_MC_file) as npz_MC:
+                npz_MCdict = {name: npz_MC[name] for name in npz_MCnames}
+
+        dict_phot_ref = dict_phot_maker(norm_dict['NB_ref'],
+                                        npz_MCdict['BB_MC0_ref'],
+                                        npz_MCdict['x_MC0_ref'],
+                                        filt_dict, filt_corr[ff],
+                                        mass_int, lum_dist)
 
     der_prop_dict_ref = derived_properties(**dict_phot_ref)
 
     BB_seed = ff + 5
     mylog.info("seed for broadband, mm=%i ss=%i : %i" % (mm, ss, BB_seed))
 
-    # Broad-band mocked magnitudes
+    # Broad-band mocked magnitudes.  BB_seed is the same for all models,
+    # so the normal draws are made once and kept in MC_buf
+    if 'rand_BB' not in MC_buf:
+        MC_buf['rand_BB'] = random_mags(BB_seed, mock_sz, 0.0, 1.0)
     BB_MC = random_mags(BB_seed, mock_sz, npz_MCdict['BB_MC0_ref'],
-                        npz_MCdict['BB_sig_ref'])
+                        npz_MCdict['BB_sig_ref'], out=MC_buf.get('BB_MC'),
+                        rand_norm=MC_buf['rand_BB'])
     stats_log(BB_MC, "BB_MC", mylog)
 
-    x_MC = BB_MC - NB_MC  # NB color excess (mocked)
+    # NB color excess (mocked)
+    x_MC = np.subtract(BB_MC, NB_MC, out=MC_buf.get('x_MC'))
     stats_log(x_MC, "x_MC", mylog)
 
     # Selection based on mocked magnitudes
-    NB_sel, NB_nosel, sig_limit = NB_select(ff, NB_MC, x_MC)
+    NB_sel, NB_nosel, sig_limit = NB_select(ff, NB_MC, x_MC,
+                                            sig_limit=sig_limit_MC)
 
     # Flag array to indicate if mock galaxies meet selection requirements
-    EW_flag0 = np.zeros(mock_sz)
-    EW_flag0[NB_sel[0], NB_sel[1]] = 1
+    EW_flag0 = MC_buf.get('EW_flag0')
+    if EW_flag0 is None:
+        EW_flag0 = NB_sel.astype(np.uint8)
+    else:
+        np.copyto(EW_flag0, NB_sel)
 
     # Not sure if we should use true logEW or the mocked values
     # Currently using mocked values
-    # logEW_MC = mock_ones(logEW_MC_ref, Nmock)
 
     # Replace NB, BB and x with mocked values
     dict_phot_MC = dict_phot_ref.copy()
@@ -138,7 +207,13 @@ def main(int_dict, npz_MC_file, mock_sz, ss_range, mass_dict, norm_dict,
     dict_phot_MC['x'] = x_MC
 
     der_prop_dict_MC = derived_properties(std_mass_int=std_mass_int,
+                                          rand_logM=MC_buf.get('rand_logM'),
                                           **dict_phot_MC)
+
+    # Mocked magnitudes are float32, so the derived (logarithmic) properties
+    # are stored the same way for the statistics and plots that follow
+    for key in der_prop_dict_MC:
+        der_prop_dict_MC[key] = der_prop_dict_MC[key].astype(np.float32)
     stats_log(der_prop_dict_MC['logEW'], "logEW_MC", mylog)
     stats_log(der_prop_dict_MC['NB_flux'], "flux_MC", mylog)
     stats_log(der_prop_dict_MC['Ha_Flux'], "HaFlux_MC", mylog)
@@ -1,5 +1,4 @@
 from os.path import exists, join
-from scipy.interpolate import interp1d
 import numpy as np
 
 from .config import path0, npz_path0, filters
@@ -7,8 +6,32 @@ from .config import npz_NBnames
 from .select import get_sigma
 from .config import m_NB
 
+
+def read_NB_numbers(npz_file):
+    """
+    Purpose:
+      Read per-filter NB magnitude bins and normalized number counts from
+      the NB_numbers npz file
+
+    :param npz_file: full path to NB_numbers.npz
+    :return: dictionary of lists containing 'mag_arr' and 'N_norm0' for
+             each filter
+    """
+
+    with np.load(npz_file) as npz0:
+        if 'N_bins' in npz0.files:
+            split_idx = np.cumsum(npz0['N_bins'])[:-1]
+            return {'mag_arr': np.split(npz0['mag_arr'], split_idx),
+                    'N_norm0': np.split(npz0['N_norm0'], split_idx)}
+
+    # Older files store the bins as pickled object arrays
+    with np.load(npz_file, allow_pickle=True) as npz0:
+        return {'mag_arr': list(npz0['mag_arr']),
+                'N_norm0': list(npz0['N_norm0'])}
+
+
 # Number density for normalization
-npz_slope = np.load(join(path0, 'Completeness/NB_numbers.npz'), allow_pickle=True)
+npz_slope = read_NB_numbers(join(path0, 'Completeness/NB_numbers.npz'))
 
 
 def get_normalization(ff, Nmock, NB, Nsim, NB_bin, mylog, redo=False):
@@ -19,17 +42,22 @@ def get_normalization(ff, Nmock, NB, Nsim, NB_bin, mylog, redo=False):
 
     if not exists(npz_NBfile) or redo:
         N_mag_mock = npz_slope['N_norm0'][ff] * Nsim * NB_bin
-        N_interp = interp1d(npz_slope['mag_arr'][ff], N_mag_mock)
-        Ndist_mock = np.int_(np.round(N_interp(NB)))
-        NB_ref = np.repeat(NB, Ndist_mock)
+        # mag_arr are increasing histogram bin edges
+        N_interp = np.interp(NB, npz_slope['mag_arr'][ff], N_mag_mock)
+        Ndist_mock = np.int_(np.round(N_interp))
+        NB_ref = np.repeat(NB.astype(np.float32), Ndist_mock)
 
-        Ngal = NB_ref.size  # Number of galaxies, populate with eval
+        Ngal = NB_ref.size  # Number of galaxies
 
         NB_sig = get_sigma(NB, m_NB[ff], sigma=3.0)
-        NB_sig_ref = np.repeat(NB_sig, Ndist_mock)  # populate with eval
+        NB_sig_ref = np.repeat(NB_sig.astype(np.float32), Ndist_mock)
 
-        for name in npz_NBnames:
-            norm_dict[name] = eval(name)
+        norm_dict['N_mag_mock'] = N_mag_mock
+        norm_dict['Ndist_mock'] = Ndist_mock
+        norm_dict['Ngal'] = Ngal
+        norm_dict['Nmock'] = Nmock
+        norm_dict['NB_ref'] = NB_ref
+        norm_dict['NB_sig_ref'] = NB_sig_ref
 
         if exists(npz_NBfile):
             mylog.info("Overwriting : " + npz_NBfile)
@@ -39,12 +67,9 @@ def get_normalization(ff, Nmock, NB, Nsim, NB_bin, mylog, redo=False):
     else:
         if not redo:
             mylog.info("File found : " + npz_NBfile)
-            npz_NB = np.load(npz_NBfile)
-
-            # for key0 in npz_NB.keys():
-            #    cmd1 = key0 + " = npz_NB['" + key0 + "']"
-            #    exec (cmd1)
-
-            norm_dict = dict(npz_NB)
+            with np.load(npz_NBfile) as npz_NB:
+                for name in npz_NBnames:
+                    norm_dict[name] = npz_NB[name]
+            norm_dict['Ngal'] = int(norm_dict['Ngal'])
 
     return norm_dict
@@ -99,3 +99,22 @@ def run_merge_final_plots(dir0):
         merge_final_plots(dir0, filt, best_tab=best_tab)
 
     print("Exiting run_merge_final_plots")
+
+
+def merge_avg_sigma_plots(pdf_files, outfile):
+    """
+    Purpose:
+      Combine single-page avg_sigma plots for each filter into one file
+
+    :param pdf_files: list of avg_sigma PDF filenames
+    :param outfile: filename for combined PDF
+    """
+
+    pdf_writer = PdfFileWriter()
+
+    for pdf_file in pdf_files:
+        pdf = PdfFileReader(pdf_file)
+        pdf_writer.addPage(pdf.getPage(0))
+
+    with open(outfile, 'wb') as pdf_output:
+        pdf_writer.write(pdf_output)
@@ -2,11 +2,9 @@ import numpy as np
 import matplotlib.pyplot as plt
 from scipy.interpolate import interp1d
 
-from chun_codes import intersect_ndim
-
 from . import EW_lab, Flux_lab, avg_sig_ctype, M_lab
 from . import cmap_sel, cmap_nosel
-from .stats import avg_sig_label, N_avg_sig_label
+from .stats import avg_sig_label, N_avg_sig_label, avg_sig
 from .fitting import fit_sequence, draw_linear_fit, linear
 
 M_xlimit = (4.0, 10.0)
@@ -95,9 +93,9 @@ def plot_MACT(ax, dict_NB, x0, y0, size=5):
         y0 = dict_NB[y0]
 
     ax.scatter(x0[w_spec], y0[w_spec], color='k', edgecolor='none',
-               alpha=0.5, s=size)
+               alpha=0.5, s=size, rasterized=True)
     ax.scatter(x0[wo_spec], y0[wo_spec], facecolor='none', edgecolor='k',
-               alpha=0.5, s=size)
+               alpha=0.5, s=size, rasterized=True)
 
 
 def plot_mock(ax, dict_MC, x0, y0, x_limit=None, y_limit=None,
@@ -132,9 +130,6 @@ def plot_mock(ax, dict_MC, x0, y0, x_limit=None, y_limit=None,
     if isinstance(y0, str):
         y0 = dict_MC[y0]
 
-    is1, is2 = NB_sel[0], NB_sel[1]
-    in1, in2 = NB_nosel[0], NB_nosel[1]
-
     if not isinstance(x_limit, type(None)):
         ax.set_xlim(x_limit)
     else:
@@ -148,11 +143,13 @@ def plot_mock(ax, dict_MC, x0, y0, x_limit=None, y_limit=None,
     x_lim = ax.get_xlim()
     y_lim = ax.get_ylim()
 
+    # Binned counts drawn as an image, with empty bins left transparent
     extent = (x_lim[0], x_lim[1], y_lim[0], y_lim[1])
-    ax.hexbin(x0[in1, in2], y0[in1, in2], gridsize=100, mincnt=1,
-              extent=extent, cmap=cmap_nosel, linewidth=0.2)
-    ax.hexbin(x0[is1, is2], y0[is1, is2], gridsize=100, mincnt=1,
-              extent=extent, cmap=cmap_sel, linewidth=0.2)
+    for sel, cmap in zip([NB_nosel, NB_sel], [cmap_nosel, cmap_sel]):
+        H = np.histogram2d(x0[sel], y0[sel], bins=100,
+                           range=[x_lim, y_lim])[0]
+        ax.imshow(np.ma.masked_less(H.T, 1), origin='lower', extent=extent,
+                  aspect='auto', interpolation='nearest', cmap=cmap)
     ax.set_xlabel(xlabel)
     ax.set_ylabel(ylabel)
 
@@ -182,20 +179,18 @@ def overlay_mock_average_dispersion(ax, dict_MC, x0, y0, lowM_cutoff):
     y_std_sel = np.zeros(x_bins.shape)
 
     for ii in range(x_bins.shape[0]):
-        idx = np.where((x0 >= x_bins[ii]) & (x0 < x_bins[ii]+bin_size))
-        N_full[ii] = len(idx[0])
+        idx = (x0 >= x_bins[ii]) & (x0 < x_bins[ii]+bin_size)
+        N_full[ii] = np.count_nonzero(idx)
 
         if N_full[ii] > 0:
-            y_avg_full[ii] = np.nanmean(y0[idx[0], idx[1]])
-            y_std_full[ii] = np.nanstd(y0[idx[0], idx[1]])
-
-            NB_sel0 = intersect_ndim(idx, NB_sel, y0.shape)
-            if type(NB_sel0) == tuple:
-                N_sel[ii] = len(NB_sel0[0])
-
-                if N_full[ii] > 0:
-                    y_avg_sel[ii] = np.nanmean(y0[NB_sel0])
-                    y_std_sel[ii] = np.nanstd(y0[NB_sel0])
+            y_avg_full[ii] = np.nanmean(y0[idx])
+            y_std_full[ii] = np.nanstd(y0[idx])
+
+            NB_sel0 = idx & NB_sel
+            N_sel[ii] = np.count_nonzero(NB_sel0)
+            if N_sel[ii] > 0:
+                y_avg_sel[ii] = np.nanmean(y0[NB_sel0])
+                y_std_sel[ii] = np.nanstd(y0[NB_sel0])
             else:
                 print("Empty idx or NB_sel")
 
@@ -298,14 +293,14 @@ def plot_completeness(t_ax, dict_MC, arr0, bins, ref_arr0=None,
     NB_sel0 = dict_MC['NB_sel']
 
     # Plot mocked set
-    finite = np.where(np.isfinite(arr0))
+    finite = np.isfinite(arr0)
     if not isinstance(above_break, type(None)):
-        finite = intersect_ndim(above_break, finite, arr0.shape)
-        NB_sel0 = intersect_ndim(above_break, NB_sel0, arr0.shape)
+        finite &= above_break
+        NB_sel0 = NB_sel0 & above_break
 
     orig, bins_edges0 = np.histogram(arr0[finite], bins)
 
-    NB_sel = intersect_ndim(NB_sel0, finite, arr0.shape)
+    NB_sel = NB_sel0 & finite
 
     sel, bins_edges1 = np.histogram(arr0[NB_sel], bins)
 
@@ -325,14 +320,15 @@ def plot_completeness(t_ax, dict_MC, arr0, bins, ref_arr0=None,
 
     # Plot modeled/"true" set
     if not isinstance(ref_arr0, type(None)):
-        arr1 = np.ones((arr0.shape[0], 1)) * ref0
-        finite = np.where(np.isfinite(arr1))
+        # Read-only view repeating ref0 for each mock, no (Nmock, Ngal) copy
+        arr1 = np.broadcast_to(ref0, arr0.shape)
+        finite = np.isfinite(arr1)
         if not isinstance(above_break, type(None)):
-            finite = intersect_ndim(above_break, finite, arr0.shape)
+            finite &= above_break
 
         orig1, bins_edges01 = np.histogram(arr1[finite], bins)
 
-        NB_sel = intersect_ndim(NB_sel0, finite, arr1.shape)
+        NB_sel = NB_sel0 & finite
 
         sel1, bins_edges11 = np.histogram(arr1[NB_sel], bins)
 
@@ -360,10 +356,29 @@ def plot_completeness(t_ax, dict_MC, arr0, bins, ref_arr0=None,
         return comp_50, comp_50_ref
 
 
-def ew_flux_hist(type0, mm, ss, t2_ax, x0, avg_x0, sig_x0, x0_bins, logEW_mean,
-                 logEW_sig, EW_flag0, x0_arr0, ax3=None):
+def hist_counts(x0, bins):
+    """
+    Histogram counts of x0 for bin edges.  Uniformly spaced edges (e.g.,
+    EW_bins, Flux_bins) are binned by rescaling rather than a sorted search
+    """
+
+    widths = np.diff(bins)
+    if np.allclose(widths, widths[0]):
+        return np.histogram(x0, bins=len(widths), range=(bins[0], bins[-1]))[0]
+
+    return np.histogram(x0, bins=bins)[0]
+
+
+def ew_flux_hist(type0, t2_ax, x0, avg_x0, sig_x0, x0_bins, EW_flag0, x0_arr0,
+                 No=None):
     """
-    Generate histogram plots for EW or flux
+    Generate histogram plots for EW or flux.  No, the counts of x0 for
+    x0_bins, is the same for all models and may be provided
+
+    Returns counts for the NB emitter sample (No) and the selected mock
+    sample normalized to it (Ng), the bin edges, and the average and
+    dispersion of the selected mock sample for plot_avg_sig_models.
+    Ng, avg_gd, and sig_gd are None if no mock galaxies are selected
     """
 
     if type0 == 'EW':
@@ -371,38 +386,45 @@ def ew_flux_hist(type0, mm, ss, t2_ax, x0, avg_x0, sig_x0, x0_bins, logEW_mean,
     if type0 == 'Flux':
         x0_lab = Flux_lab
 
+    # Each sample is binned once with hist_counts and the counts are drawn
+    # with ax.hist weights
     label_x0 = N_avg_sig_label(x0, avg_x0, sig_x0)
-    No, binso, _ = t2_ax.hist(x0, bins=x0_bins, align='mid', color='black',
-                              alpha=0.5, linestyle='solid', edgecolor='none',
-                              histtype='stepfilled', label=label_x0)
+    binso = x0_bins
+    if No is None:
+        No = hist_counts(x0, binso)
+    t2_ax.hist(binso[:-1], bins=binso, weights=No, align='mid', color='black',
+               alpha=0.5, linestyle='solid', edgecolor='none',
+               histtype='stepfilled', label=label_x0)
     t2_ax.axvline(x=avg_x0, color='black', linestyle='solid', linewidth=1.5)
 
-    good = np.where((EW_flag0 == 1) & (np.isfinite(x0_arr0)))
+    Ng, avg_gd, sig_gd = None, None, None
+
+    finite = np.isfinite(x0_arr0)
+    good = (EW_flag0 == 1) & finite
+    N_good = np.count_nonzero(good)
 
     # Normalize relative to selected sample
-    if len(good[0]) > 0:
-        finite = np.where(np.isfinite(x0_arr0))
+    if N_good > 0:
+        x0_finite = x0_arr0[finite]
+        x0_good = x0_arr0[good]
 
-        norm0 = float(len(x0)) / len(good[0])
-        wht0 = np.repeat(norm0, x0_arr0.size)
-        wht0 = np.reshape(wht0, x0_arr0.shape)
+        norm0 = float(len(x0)) / N_good
 
-        avg_MC = np.average(x0_arr0[finite])
-        sig_MC = np.std(x0_arr0[finite])
+        avg_MC, sig_MC = avg_sig(x0_finite)
         label0 = N_avg_sig_label(x0_arr0, avg_MC, sig_MC)
 
-        N, bins, _ = t2_ax.hist(x0_arr0[finite], bins=x0_bins, weights=wht0[finite],
-                                align='mid', color='black', linestyle='dashed',
-                                edgecolor='black', histtype='step', label=label0)
+        N = hist_counts(x0_finite, binso)
+        t2_ax.hist(binso[:-1], bins=binso, weights=N * norm0, align='mid',
+                   color='black', linestyle='dashed', edgecolor='black',
+                   histtype='step', label=label0)
         t2_ax.axvline(x=avg_MC, color='black', linestyle='dashed', linewidth=1.5)
 
-        avg_gd = np.average(x0_arr0[good[0], good[1]])
-        sig_gd = np.std(x0_arr0[good[0], good[1]])
-        label1 = N_avg_sig_label(good[0], avg_gd, sig_gd)
-        Ng, binsg, _ = t2_ax.hist(x0_arr0[good], bins=x0_bins, weights=wht0[good],
-                                  align='mid', alpha=0.5, color='blue',
-                                  edgecolor='blue', linestyle='solid',
-                                  histtype='stepfilled', label=label1)
+        avg_gd, sig_gd = avg_sig(x0_good)
+        label1 = N_avg_sig_label(x0_good, avg_gd, sig_gd)
+        Ng = hist_counts(x0_good, binso) * norm0
+        t2_ax.hist(binso[:-1], bins=binso, weights=Ng, align='mid', alpha=0.5,
+                   color='blue', edgecolor='blue', linestyle='solid',
+                   histtype='stepfilled', label=label1)
         t2_ax.axvline(x=avg_gd, color='blue', linestyle='solid', linewidth=1.5)
 
         t2_ax.legend(loc='upper right', fancybox=True, fontsize=6, framealpha=0.75)
@@ -419,15 +441,35 @@ def ew_flux_hist(type0, mm, ss, t2_ax, x0, avg_x0, sig_x0, x0_bins, logEW_mean,
             t2_ax.set_xticks(np.arange(-17.5, -13.5, 1.0))
             t2_ax.set_xticks(np.arange(-17.5, -13.5, 1.0))
 
-        as_label = ''
-        if mm == 0:
-            as_label = '%.2f' % logEW_sig[ss]
 
-        if not isinstance(ax3, type(None)):
-            temp_x = [logEW_mean[mm] + 0.005 * (ss - 3 / 2.)]
-            ax3.scatter(temp_x, [avg_gd], marker='o', s=40, edgecolor='none',
-                        color=avg_sig_ctype[ss], label=as_label)
-            ax3.errorbar(temp_x, [avg_gd], yerr=[sig_gd], capsize=0,
-                         elinewidth=1.5, ecolor=avg_sig_ctype[ss], fmt='none')
+    return No, Ng, binso, avg_gd, sig_gd
+
+
+def plot_avg_sig_models(ax3, EW_xoff, logEW_sig, avg_arr, sig_arr=None,
+                        label=False):
+    """
+    Overlay results of all EW models on an avg_sigma plot panel with one
+    scatter (and errorbar) call for each logEW_sig.  Models that are NaN in
+    avg_arr are not drawn
+
+    :param ax3: matplotlib.axes._subplots.AxesSubplot
+    :param EW_xoff: (mm, ss) numpy array of x-axis positions for each model
+    :param logEW_sig: numpy array of log(EW) dispersions
+    :param avg_arr: (mm, ss) numpy array of averages or chi^2 values
+    :param sig_arr: (mm, ss) numpy array of dispersions.  Default: None
+    :param label: label points with logEW_sig for legend.  Default: False
+    """
 
-    return No, Ng, binso, wht0
+    for ss in range(avg_arr.shape[1]):
+        has_val = np.isfinite(avg_arr[:, ss])
+        if not has_val.any():
+            continue
+
+        temp_x = EW_xoff[has_val, ss]
+        as_label = '%.2f' % logEW_sig[ss] if label else ''
+        ax3.scatter(temp_x, avg_arr[has_val, ss], marker='o', s=40,
+                    edgecolor='none', color=avg_sig_ctype[ss], label=as_label)
+        if sig_arr is not None:
+            ax3.errorbar(temp_x, avg_arr[has_val, ss], yerr=sig_arr[has_val, ss],
+                         capsize=0, elinewidth=1.5, ecolor=avg_sig_ctype[ss],
+                         fmt='none')
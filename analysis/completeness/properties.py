@@ -1,7 +1,7 @@
 from os.path import join
-import numpy as np
+from functools import lru_cache
 
-from scipy.interpolate import interp1d
+import numpy as np
 
 from . import filter_dict  # dBB, dNB
 from ...mainseq_corrections import niiha_oh_determine
@@ -9,6 +9,7 @@ from ..NB_errors import ew_flux_dual
 from .config import path0
 
 
+@lru_cache(maxsize=None)
 def get_mag_vs_mass_interp(prefix_ff):
     """
     Purpose:
@@ -17,28 +18,54 @@ def get_mag_vs_mass_interp(prefix_ff):
     :param prefix_ff: filter prefix (str)
       Either 'Ha-NB7', 'Ha-NB816', 'Ha-NB921', or 'Ha-NB973'
 
-    :return mass_int: interp1d object for logarithm of stellar mass, logM
-    :return std_mass_int: interp1d object for dispersion in logM
+    :return mass_int: function for logarithm of stellar mass, logM.
+      Linear interpolation with linear extrapolation beyond end points
+    :return std_mass_int: function for dispersion in logM.
+      Nearest-neighbor lookup with 0.3 outside of the grid
+
+    Results are cached on prefix_ff as NB704 and NB711 share 'Ha-NB7'
     """
 
     npz_mass_file = join(path0, 'Completeness/mag_vs_mass_' + prefix_ff + '.npz')
-    npz_mass = np.load(npz_mass_file, allow_pickle=True)
-    cont_arr = npz_mass['cont_arr']
+    with np.load(npz_mass_file) as npz_mass:
+        cont_arr = npz_mass['cont_arr']
+        avg_logM = npz_mass['avg_logM']
+        std_logM = npz_mass['std_logM']
+        N_logM = npz_mass['N_logM']
+
     dmag = cont_arr[1] - cont_arr[0]
-    mgood = np.where(npz_mass['N_logM'] != 0)[0]
+    mgood = np.where(N_logM != 0)[0]
 
     x_temp = cont_arr + dmag / 2.0
-    mass_int = interp1d(x_temp[mgood], npz_mass['avg_logM'][mgood],
-                        bounds_error=False, fill_value='extrapolate',
-                        kind='linear')
 
-    m_bad = np.where(npz_mass['N_logM'] <= 1)[0]
-    std0 = npz_mass['std_logM']
+    xp = x_temp[mgood]
+    fp = avg_logM[mgood]
+    slope_lo = (fp[1] - fp[0]) / (xp[1] - xp[0])
+    slope_hi = (fp[-1] - fp[-2]) / (xp[-1] - xp[-2])
+
+    def mass_int(x):
+        x = np.asarray(x)
+        logM = np.interp(x, xp, fp)
+        logM = np.where(x < xp[0], fp[0] + slope_lo * (x - xp[0]), logM)
+        logM = np.where(x > xp[-1], fp[-1] + slope_hi * (x - xp[-1]), logM)
+        return logM
+
+    m_bad = np.where(N_logM <= 1)[0]
+    std0 = std_logM
     if len(m_bad) > 0:
         std0[m_bad] = 0.30
 
-    std_mass_int = interp1d(x_temp, std0, fill_value=0.3, bounds_error=False,
-                            kind='nearest')
+    # Nearest-neighbor lookup table: bin edges are the mid-points of x_temp
+    # (half-way points belong to the lower bin as in interp1d(kind='nearest'))
+    # padded with 0.3 on both ends for values outside of the grid
+    std_edges = np.concatenate([[np.nextafter(x_temp[0], -np.inf)],
+                                (x_temp[1:] + x_temp[:-1]) / 2.0,
+                                [x_temp[-1]]])
+    std_lut = np.concatenate([[0.30], std0, [0.30]])
+
+    def std_mass_int(x):
+        return std_lut[np.searchsorted(std_edges, x)]
+
     return mass_int, std_mass_int
 
 
@@ -58,7 +85,12 @@ def correct_NII(log_flux, NIIHa):
     :param NIIHa: array containing NII/Ha flux ratios
     """
 
-    return log_flux - np.log10(1 + NIIHa)
+    Ha_flux = np.array(NIIHa, dtype=np.float64)
+    Ha_flux += 1
+    np.log10(Ha_flux, out=Ha_flux)
+    np.subtract(log_flux, Ha_flux, out=Ha_flux)
+
+    return Ha_flux
 
 
 def get_NIIHa_logOH(logM):
@@ -73,22 +105,16 @@ def get_NIIHa_logOH(logM):
     :return logOH: log(O/H) abundances from PP04 formula
     """
 
-    NIIHa = np.zeros(logM.shape)
+    # Constant at low mass, linear in logM at high mass
+    NIIHa = np.where(logM > 8.0, 0.169429547993 * logM - 1.29299670728,
+                     0.0624396766589)
 
-    low_mass = np.where(logM <= 8.0)
-    if len(low_mass[0]) > 0:
-        NIIHa[low_mass] = 0.0624396766589
+    # Compute metallicity from log([NII]6583/H-alpha), evaluated in place
+    NII6583_Ha = NIIHa / (1 + 1 / 2.96)
+    np.log10(NII6583_Ha, out=NII6583_Ha)
 
-    high_mass = np.where(logM > 8.0)
-    if len(high_mass[0]) > 0:
-        NIIHa[high_mass] = 0.169429547993 * logM[high_mass] - 1.29299670728
-
-    # Compute metallicity
-    NII6583_Ha = NIIHa * 1 / (1 + 1 / 2.96)
-
-    NII6583_Ha_resize = np.reshape(NII6583_Ha, NII6583_Ha.size)
-    logOH = niiha_oh_determine(np.log10(NII6583_Ha_resize), 'PP04_N2') - 12.0
-    logOH = np.reshape(logOH, logM.shape)
+    logOH = niiha_oh_determine(NII6583_Ha.ravel(), 'PP04_N2') - 12.0
+    logOH = logOH.reshape(logM.shape)
 
     return NIIHa, logOH
 
@@ -103,12 +129,18 @@ def HaSFR_metal_dep(logOH, orig_lum):
     :param orig_lum: logarithm of H-alpha luminosity
     """
 
-    y = logOH + 3.31
+    y = np.array(logOH, dtype=np.float64)
+    y += 3.31
 
-    # metallicity-dependent SFR conversion
-    log_SFR_LHa = -41.34 + 0.39 * y + 0.127 * y ** 2
+    # metallicity-dependent SFR conversion, -41.34 + 0.39*y + 0.127*y**2,
+    # accumulated in place
+    log_SFR = 0.39 * y
+    log_SFR += -41.34
+    np.square(y, out=y)
+    y *= 0.127
+    log_SFR += y
 
-    log_SFR = log_SFR_LHa + orig_lum
+    log_SFR += orig_lum
 
     return log_SFR
 
@@ -120,22 +152,37 @@ def dict_phot_maker(NB, BB, x, filt_dict, filt_corr, mass_int, lum_dist):
     return dict_phot
 
 
+def mass_scatter_draws(shape):
+    """
+    Standard normal draws for the scatter in logM about mass_int.  The seed
+    is fixed, so the draws only depend on shape and can be reused
+
+    :param shape: tuple for the shape of the magnitude arrays
+    """
+
+    np.random.seed(348)
+    return np.random.normal(size=shape)
+
+
 def derived_properties(NB, BB, x, filt_dict, filt_corr, mass_int, lum_dist,
-                       std_mass_int=None, suffix=''):
+                       std_mass_int=None, suffix='', rand_logM=None):
     EW, NB_flux = ew_flux_dual(NB, BB, x, filt_dict)
 
+    # EW and NB_flux are new arrays, so logarithms are taken in place
     der_prop_dict = dict()
-    der_prop_dict['logEW'+suffix] = np.log10(EW)
+    der_prop_dict['logEW'+suffix] = np.log10(EW, out=EW)
 
     # Apply NB filter correction from beginning
-    der_prop_dict['NB_flux'+suffix] = np.log10(NB_flux * filt_corr)
+    NB_flux *= filt_corr
+    der_prop_dict['NB_flux'+suffix] = np.log10(NB_flux, out=NB_flux)
 
     logM = mass_int(BB)
     if not isinstance(std_mass_int, type(None)):
         std_ref = std_mass_int(BB)
-        np.random.seed(348)
-        rtemp = np.random.normal(size=NB.shape)
-        logM += std_ref * rtemp
+        if rand_logM is None:
+            rand_logM = mass_scatter_draws(NB.shape)
+        std_ref *= rand_logM
+        logM += std_ref
     der_prop_dict['logM'+suffix] = logM
 
     NIIHa, logOH = get_NIIHa_logOH(logM)
@@ -143,8 +190,9 @@ def derived_properties(NB, BB, x, filt_dict, filt_corr, mass_int, lum_dist,
     der_prop_dict['logOH'+suffix] = logOH
 
     der_prop_dict['Ha_Flux'+suffix] = correct_NII(der_prop_dict['NB_flux'+suffix], NIIHa)
-    der_prop_dict['Ha_Lum'+suffix] = der_prop_dict['Ha_Flux'+suffix] + \
-                                     np.log10(4 * np.pi) + 2 * np.log10(lum_dist)
+    Ha_Lum = der_prop_dict['Ha_Flux'+suffix] + np.log10(4 * np.pi)
+    Ha_Lum += 2 * np.log10(lum_dist)
+    der_prop_dict['Ha_Lum'+suffix] = Ha_Lum
 
     der_prop_dict['logSFR'+suffix] = HaSFR_metal_dep(der_prop_dict['logOH'+suffix],
                                                      der_prop_dict['Ha_Lum'+suffix])
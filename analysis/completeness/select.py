@@ -3,8 +3,6 @@ import numpy as np
 from .config import m_NB, cont_lim, minthres
 from .properties import compute_EW
 
-from scipy.interpolate import interp1d
-
 m_AB = 48.6
 
 
@@ -43,14 +41,22 @@ def color_cut(x, lim1, lim2, mean=0.0, sigma=3.0):
     f1 = (sigma / 3.0) * 10 ** (-0.4 * (m_AB + lim1))
     f2 = (sigma / 3.0) * 10 ** (-0.4 * (m_AB + lim2))
 
-    f = 10 ** (-0.4 * (m_AB + x))
-
-    val = mean - 2.5 * np.log10(1 - np.sqrt(f1 ** 2 + f2 ** 2) / f)
+    # sqrt(f1**2 + f2**2) / f with f = 10**(-0.4*(m_AB + x)), evaluated in
+    # place on a single float64 array
+    val = np.array(x, dtype=np.float64)
+    val += m_AB
+    val *= 0.4
+    np.power(10.0, val, out=val)
+    val *= -np.sqrt(f1 ** 2 + f2 ** 2)
+    val += 1
+    np.log10(val, out=val)
+    val *= -2.5
+    val += mean
 
     return val
 
 
-def NB_select(ff, NB_mag, x_mag):
+def NB_select(ff, NB_mag, x_mag, sig_limit=None):
     """
     Purpose:
       NB excess color selection
@@ -58,16 +64,21 @@ def NB_select(ff, NB_mag, x_mag):
     :param ff: integer for filter
     :param NB_mag: numpy array of NB magnitudes
     :param x_mag: numpy array of NB excess colors, continuum - NB
+    :param sig_limit: pre-computed 3-sig limit for NB_mag (numpy array).
+      Default: computed with color_cut
 
-    :return NB_sel: numpy index for NB excess selection
-    :return NB_nosel: numpy index for non NB excess selection
+    :return NB_sel: boolean numpy array for NB excess selection
+    :return NB_nosel: boolean numpy array for non NB excess selection
     :return sig_limit: numpy array providing 3-sig limit for NB_mag input
     """
 
-    sig_limit = color_cut(NB_mag, m_NB[ff], cont_lim[ff])
+    if sig_limit is None:
+        sig_limit = color_cut(NB_mag, m_NB[ff], cont_lim[ff])
 
-    NB_sel = np.where((x_mag >= minthres[ff]) & (x_mag >= sig_limit))
-    NB_nosel = np.where((x_mag < minthres[ff]) | (x_mag < sig_limit))
+    NB_sel = (x_mag >= minthres[ff]) & (x_mag >= sig_limit)
+    # Not the complement of NB_sel: galaxies with a NaN sig_limit are in
+    # neither set
+    NB_nosel = (x_mag < minthres[ff]) | (x_mag < sig_limit)
 
     return NB_sel, NB_nosel, sig_limit
 
@@ -80,15 +91,21 @@ def get_EW(ff, mylog):
     :param ff: integer input for filter
     :param mylog: logger class
 
-    :return EW_int: scipy.interp1d object
+    :return EW_int: function mapping log(EW) to NB excess color
     """
     x = np.arange(0.01, 10.00, 0.01)
     EW_ref = compute_EW(x, ff)
 
-    good = np.where(np.isfinite(EW_ref))[0]
-    mylog.info('EW_ref (min/max): %f %f ' % (min(EW_ref[good]),
-                                             max(EW_ref[good])))
-    EW_int = interp1d(EW_ref[good], x[good], bounds_error=False,
-                      fill_value=(-3.0, np.max(EW_ref[good])))
+    good = np.isfinite(EW_ref)
+    EW_good = EW_ref[good]
+    x_right = EW_good.max()
+    mylog.info('EW_ref (min/max): %f %f ' % (EW_good.min(), x_right))
+
+    # EW_ref increases with x where it is finite (10**(-0.4*x) > dNB/dBB),
+    # so the grid is already sorted as np.interp requires
+    x_good = x[good]
+
+    def EW_int(logEW):
+        return np.interp(logEW, EW_good, x_good, left=-3.0, right=x_right)
 
     return EW_int
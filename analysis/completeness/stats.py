@@ -1,4 +1,6 @@
 from os.path import join, dirname
+import logging
+from multiprocessing import Pool
 import numpy as np
 import matplotlib.pyplot as plt
 
@@ -6,7 +8,7 @@ from chun_codes import compute_onesig_pdf
 
 from astropy.io import ascii as asc
 
-from . import avg_sig_ctype, M_lab
+from . import M_lab
 from .config import npz_path0, filters, path0
 from .dataset import get_mact_data
 
@@ -23,16 +25,37 @@ def stats_log(input_arr, arr_type, mylog):
     :return None. mylog is called
     """
 
-    min0 = np.nanmin(input_arr)
-    max0 = np.nanmax(input_arr)
-    mean0 = np.nanmean(input_arr)
-    med0 = np.nanmedian(input_arr)
+    if not mylog.isEnabledFor(logging.INFO):
+        return
+
+    # Drop NaNs once rather than in each of the nan* reductions. Without
+    # NaNs, input_arr is used directly and only the median partitions a copy
+    values = np.ravel(input_arr)
+    nan_mask = np.isnan(values)
+    is_copy = nan_mask.any()
+    if is_copy:
+        values = values[~nan_mask]
+
+    if values.size == 0:
+        min0 = max0 = mean0 = med0 = np.nan
+    else:
+        min0 = values.min()
+        max0 = values.max()
+        mean0 = values.mean()
+        med0 = np.median(values, overwrite_input=is_copy)
 
     str0 = "%s: min=%f max=%f mean=%f median=%f" % (arr_type, min0, max0,
                                                     mean0, med0)
     mylog.info(str0)
 
 
+# Format strings for avg_sig_label for each panel type
+avg_sig_fmt = {'EW': r'$\langle\log({\rm EW})\rangle$ = %.2f' + '\n' +
+               r'$\sigma[\log({\rm EW})]$ = %.2f',
+               'Flux': r'$\langle\log(F_{{\rm H}\alpha})\rangle$ = %.2f' + '\n' +
+               r'$\sigma[\log(F_{{\rm H}\alpha})]$ = %.2f'}
+
+
 def avg_sig_label(str0, avg, sigma, panel_type=''):
     """
     Purpose:
@@ -47,17 +70,24 @@ def avg_sig_label(str0, avg, sigma, panel_type=''):
     :return: str0: Revised string
     """
 
-    if panel_type == 'EW':
-        str0 += r'$\langle\log({\rm EW})\rangle$ = %.2f' % avg
-        str0 += '\n' + r'$\sigma[\log({\rm EW})]$ = %.2f' % sigma
-
-    if panel_type == 'Flux':
-        str0 += r'$\langle\log(F_{{\rm H}\alpha})\rangle$ = %.2f' % avg
-        str0 += '\n' + r'$\sigma[\log(F_{{\rm H}\alpha})]$ = %.2f' % sigma
+    if panel_type in avg_sig_fmt:
+        str0 += avg_sig_fmt[panel_type] % (avg, sigma)
 
     return str0
 
 
+def avg_sig(x0):
+    """
+    Average and dispersion (as np.std) of x0.  The average is computed once
+    and re-used for the dispersion. Accumulated in float64 for float32 input
+    """
+
+    avg = np.mean(x0, dtype=np.float64)
+    sigma = np.sqrt(np.mean(np.square(x0 - avg)))
+
+    return avg, sigma
+
+
 def N_avg_sig_label(x0, avg, sigma):
     """
     String containing average and sigma for ax.legend() labels
@@ -67,7 +97,7 @@ def N_avg_sig_label(x0, avg, sigma):
            (x0.size, avg, sigma)
 
 
-def stats_plot(type0, ax2, ax3, ax, s_row, Ng, No, binso, EW_mean, EW_sig, ss):
+def stats_plot(type0, ax2, ax, s_row, Ng, No, binso, EW_mean, EW_sig):
     """
     Plot statistics (chi^2, model vs data comparison) for each model
 
@@ -77,9 +107,6 @@ def stats_plot(type0, ax2, ax3, ax, s_row, Ng, No, binso, EW_mean, EW_sig, ss):
     ax2 : matplotlib.axes._subplots.AxesSubplot
        matplotlib axes for stats plot
 
-    ax3 : matplotlib.axes._subplots.AxesSubplot
-       matplotlib axes for avg_sigma plot
-
     ax : matplotlib.axes._subplots.AxesSubplot
        matplotlib axes for main plot
 
@@ -92,8 +119,8 @@ def stats_plot(type0, ax2, ax3, ax, s_row, Ng, No, binso, EW_mean, EW_sig, ss):
     EW_sig: float
        Value of sigma logEW in model
 
-    ss: int
-       Integer indicating index for sigma
+    Returns reduced chi^2, NaN if there are too few bins. Results of all
+    models are drawn on the avg_sigma plot with plot_avg_sig_models
     """
 
     delta = (Ng - No) / np.sqrt(Ng + No)
@@ -105,12 +132,15 @@ def stats_plot(type0, ax2, ax3, ax, s_row, Ng, No, binso, EW_mean, EW_sig, ss):
 
     ax2[s_row][pn].axhline(0.0, linestyle='dashed')  # horizontal line at zero
 
-    ax2[s_row][pn].scatter(binso[:-1], delta)
-    no_use = np.where((Ng == 0) | (No == 0))[0]
+    # Uniform markers are drawn as Line2D, which is cheaper than a
+    # PathCollection from scatter. markersize is sqrt of scatter's s
+    ax2[s_row][pn].plot(binso[:-1], delta, marker='o', linestyle='none',
+                        color='C0', markersize=6)
+    no_use = (Ng == 0) | (No == 0)
 
-    if len(no_use) > 0:
-        ax2[s_row][pn].scatter(binso[:-1][no_use], delta[no_use], marker='x',
-                               color='r', s=20)
+    if no_use.any():
+        ax2[s_row][pn].plot(binso[:-1][no_use], delta[no_use], marker='x',
+                            linestyle='none', color='r', markersize=np.sqrt(20))
 
     # ax2[s_row][pn].set_ylabel(r'1 - $N_{\rm mock}/N_{\rm data}$')
     if type0 == 'EW':
@@ -120,23 +150,20 @@ def stats_plot(type0, ax2, ax3, ax, s_row, Ng, No, binso, EW_mean, EW_sig, ss):
         annot_txt += r'$\sigma[\log({\rm EW})] = %.2f$' % EW_sig
         ax2[s_row][pn].set_title(annot_txt, fontdict={'fontsize': 10}, loc='left')
 
-    # Compute chi^2
-    use_bins = np.where((Ng != 0) & (No != 0))[0]
-    if len(use_bins) > 2:
-        fit_chi2 = np.sum(delta[use_bins] ** 2) / (len(use_bins) - 2)
+    # Compute chi^2 from bins with both mock and data counts
+    delta_use = delta[~no_use]
+    N_use = delta_use.size
+    if N_use > 2:
+        fit_chi2 = np.dot(delta_use, delta_use) / (N_use - 2)
         c_txt = r'$\chi^2_{\nu}$ = %.2f' % fit_chi2
-
-        ax3.scatter([EW_mean + 0.005 * (ss - 3 / 2.)], [fit_chi2],
-                    marker='o', s=40, color=avg_sig_ctype[ss],
-                    edgecolor='none')
     else:
-        print("Too few bins")
+        # Counted and reported once by the caller
         c_txt = r'$\chi^2_{\nu}$ = Unavailable'
         fit_chi2 = np.nan
 
     ax.annotate(c_txt, [0.025, 0.975], xycoords='axes fraction',
                 ha='left', va='top')
-    c_txt += '\n' + r'N = %i' % len(use_bins)
+    c_txt += '\n' + r'N = %i' % N_use
     ax2[s_row][pn].annotate(c_txt, [0.975, 0.975], ha='right',
                             xycoords='axes fraction', va='top')
 
@@ -147,13 +174,12 @@ def bin_MACT(x_cen, dict_NB):
 
     bin_size = x_cen[1] - x_cen[0]
 
-    N_bins = np.zeros(x_cen.shape)
-    logMstar = dict_NB['logMstar']
+    edges = np.append(x_cen - bin_size/2.0, x_cen[-1] + bin_size/2.0)
 
-    for bb in range(len(N_bins)):
-        idx = np.where((logMstar >= x_cen[bb]-bin_size/2.0) &
-                       (logMstar < x_cen[bb]+bin_size/2.0))[0]
-        N_bins[bb] = len(idx)
+    # Bins are [lo, hi), so np.histogram's closed last bin is not used.
+    # Number of galaxies below each edge from the sorted masses
+    N_below = np.searchsorted(np.sort(dict_NB['logMstar']), edges, side='left')
+    N_bins = np.diff(N_below)
 
     return N_bins
 
@@ -161,17 +187,82 @@ def bin_MACT(x_cen, dict_NB):
 def lowM_cutoff_sigma(logMstar):
     """Return low-mass cutoff.  If lower than 6.0 return 6.0"""
 
-    avg0 = np.average(logMstar)
-    sig0 = np.std(logMstar)
+    avg0, sig0 = avg_sig(logMstar)
 
-    lowM_cutoff = avg0 - 1.5 * sig0
-    if lowM_cutoff < 6.0:
-        lowM_cutoff = 6.0
+    return max(avg0 - 1.5 * sig0, 6.0)
 
-    return lowM_cutoff
 
+def randomize_SFR_bins(infile, random_file, N_bins, MC_Nsim):
+    """
+    Purpose:
+      Randomly select N_bins galaxies in each stellar mass bin from the
+      best-fit MC sample of a filter, MC_Nsim times, to reproduce the MACT
+      sample selection.  Results are written to random_file if provided
+
+    :param infile: npz file of the binned SFR dispersion for the best fit
+    :param random_file: npz file to write randomized arrays to, or None
+    :param N_bins: numpy array of MACT sample size in each stellar mass bin
+    :param MC_Nsim: number of randomizations
+    :return rand_offset: float32 array of randomized SFR offsets with shape
+      (len(x_cen), max(N_bins), MC_Nsim)
+    :return rand_mask: boolean array with True for un-used elements
+    """
 
-def compute_weighted_dispersion(best_fit_file, mylog, monte_carlo=False):
+    with np.load(infile) as npz0:
+        x_cen = npz0['x_cen']
+        logM_MC = npz0['logM_MC']
+        # Stacked so that one gather populates all three quantities. Cast
+        # to float32 here so the gather does not create float64 temporaries.
+        # Bin membership uses the original logM_MC
+        MC_stack = np.array([logM_MC, npz0['logSFR_MC'], npz0['offset_MC']],
+                            dtype=np.float32)
+
+    # Sort by stellar mass once so each bin is a contiguous range
+    # (bins are +/-0.25 dex about x_cen and need not be contiguous)
+    s_idx = np.argsort(logM_MC, kind='stable')
+    logM_sorted = logM_MC[s_idx]
+    lo_idx = np.searchsorted(logM_sorted, x_cen - 0.5 / 2.0, side='left')
+    hi_idx = np.searchsorted(logM_sorted, x_cen + 0.5 / 2.0, side='left')
+
+    N_max = int(np.max(N_bins))
+
+    rand_shape  = (len(x_cen), N_max, MC_Nsim)
+
+    # One buffer for logM, logSFR and offset so each bin is a single gather
+    rand_all = np.zeros((3,) + rand_shape, dtype=np.float32)
+    rand_logM, rand_logSFR, rand_offset = rand_all
+
+    # Mask un-used elements beyond N_bins for each bin
+    rand_mask = np.arange(N_max)[None, :, None] >= N_bins[:, None, None]
+    rand_mask = np.broadcast_to(rand_mask, rand_shape).copy()
+
+    for bb in range(len(x_cen)):
+        # Get index within stellar mass range for MC sample
+        # (in increasing order as returned by np.where)
+        idx = np.sort(s_idx[lo_idx[bb]:hi_idx[bb]])
+        np.random.seed(bb)
+        if N_bins[bb] > 0:
+            # Random choice selection of N_bins * MC_Nsim
+            # This reproduces sample selection for each bin for each filter
+            temp = np.random.choice(idx, size=(int(N_bins[bb]), MC_Nsim))
+
+            # Populate content
+            np.take(MC_stack, temp, axis=1, mode='clip',
+                    out=rand_all[:, bb, 0:N_bins[bb], :])
+
+    # y_rand_offset = np.nanstd(np.where(rand_mask, np.nan, rand_offset), axis=1)
+    # ax.scatter(np.repeat(x_cen, MC_Nsim), y_rand_offset, s=1)
+
+    if random_file is not None:
+        np.savez(random_file, rand_logM=rand_logM, rand_logSFR=rand_logSFR,
+                 rand_offset=rand_offset, rand_mask=rand_mask)
+
+    # Copy so the logM and logSFR parts of rand_all can be released
+    return rand_offset.copy(), rand_mask
+
+
+def compute_weighted_dispersion(best_fit_file, mylog, monte_carlo=False,
+                                n_jobs=1, persist_mc=True):
     """
     Purpose:
       Computes a weighted dispersion of the main sequence vs stellar mass.
@@ -181,6 +272,9 @@ def compute_weighted_dispersion(best_fit_file, mylog, monte_carlo=False):
     :param best_fit_file: filename of best-fit
     :param mylog: logging object
     :param monte_carlo: Bool to do randomization to compute observational dispersion
+    :param n_jobs: number of processes for randomization of filters
+    :param persist_mc: Bool to write randomized arrays to npz files.  These
+      are needed to later run with monte_carlo=False
     """
 
     MC_Nsim = 1000
@@ -191,8 +285,8 @@ def compute_weighted_dispersion(best_fit_file, mylog, monte_carlo=False):
     mact_dispersion_file = join(path0, 'Tables/4_ascii.txt')
     mact_dispersion_tab = asc.read(mact_dispersion_file, format='fixed_width_two_line')
     mass_range = mact_dispersion_tab['mass_range'].data
-    logM_bins = [np.average(np.float_(mass_range[xx].split('--'))) for
-                 xx in range(len(mass_range))]
+    logM_bins = np.array([xx.split('--') for xx in mass_range],
+                         dtype=float).mean(axis=1)
     ax.scatter(logM_bins, mact_dispersion_tab['obs'].data,
                marker='o', color='b', s=100, alpha=0.5,
                label=r'$\mathcal{MACT}$', zorder=2)
@@ -204,6 +298,8 @@ def compute_weighted_dispersion(best_fit_file, mylog, monte_carlo=False):
     best_EWmean = comp_tab0['log_EWmean'].data
     best_EWsig  = comp_tab0['log_EWsig'].data
 
+    rand_args = []
+
     # ctype = ['b', 'b', 'orange', 'g', 'r']
     for filt, ff in zip(filters, range(len(filters))):
         # Read in MACT sample
@@ -213,66 +309,46 @@ def compute_weighted_dispersion(best_fit_file, mylog, monte_carlo=False):
         infile = join(npz_path0,
                       '%s_SFR_bin_%.2f_%0.2f.npz' % (filt, best_EWmean[ff], best_EWsig[ff]))
         mylog.info("Reading : " + infile)
-        npz0 = np.load(infile)
-
-        x_cen = npz0['x_cen']
-        std_full = npz0['y_std_full']
-        std_sel = npz0['y_std_sel']
+        with np.load(infile) as npz0:
+            x_cen = npz0['x_cen']
+            std_full = npz0['y_std_full']
+            std_sel = npz0['y_std_sel']
 
         N_bins = np.int_(bin_MACT(x_cen, dict_NB))
         mylog.info("N_bins : {0} {1}".format(filt, N_bins))
 
+        # Dispersions are combined in quadrature, weighted by MACT sample
+        # size, and accumulated over filters
         if ff == 0:
-            set_shape = (len(filt), len(x_cen))
-            wht_sig_full = np.zeros(set_shape)
-            wht_sig_sel = np.zeros(set_shape)
-            N_bins_filt = np.zeros(set_shape)
+            wht_var_full = np.zeros(len(x_cen))
+            wht_var_sel = np.zeros(len(x_cen))
+            N_bins_tot = np.zeros(len(x_cen), dtype=int)
 
-        wht_sig_full[ff] = std_full
-        wht_sig_sel[ff] = std_sel
-        N_bins_filt[ff] = N_bins
+        wht_var_full += std_full**2 * N_bins
+        wht_var_sel += std_sel**2 * N_bins
+        N_bins_tot += N_bins
 
         # Construct arrays of randomization to compute SFR dispersion
         if monte_carlo:
-            rand_shape  = (len(x_cen), max(N_bins), MC_Nsim)
-            rand_logM   = np.zeros(rand_shape)
-            rand_logSFR = np.zeros(rand_shape)
-            rand_offset = np.zeros(rand_shape)
-            rand_mask   = np.zeros(rand_shape)
-
-            for bb in range(len(x_cen)):
-                # Get index within stellar mass range for MC sample
-                idx = np.where((npz0['logM_MC'] >= x_cen[bb] - 0.5 / 2.0) &
-                               (npz0['logM_MC']  < x_cen[bb] + 0.5 / 2.0))[0]
-                np.random.seed = bb
-                if N_bins[bb] > 0:
-                    # Random choice selection of N_bins * MC_Nsim
-                    # This reproduces sample selection for each bin for each filter
-                    temp = np.random.choice(idx, size=(int(N_bins[bb]), MC_Nsim))
-
-                    # Populate content
-                    rand_logM[bb, 0:N_bins[bb], :] = npz0['logM_MC'][temp]
-                    rand_logSFR[bb, 0:N_bins[bb], :] = npz0['logSFR_MC'][temp]
-                    rand_offset[bb, 0:N_bins[bb], :] = npz0['offset_MC'][temp]
-                    if N_bins[bb] < max(N_bins):  # Mask un-used elements
-                        rand_mask[bb, N_bins[bb]:max(N_bins), :] = 1
-                else:
-                    rand_mask[bb, :, :] = 1
-
-            # y_rand_offset = np.std(np.ma.MaskedArray(rand_offset, mask=rand_mask), axis=1)
-            # ax.scatter(np.repeat(x_cen, MC_Nsim), y_rand_offset, s=1)
-
-            random_file = join(npz_path0,
-                               '%s_rand_SFR_%.2f_%0.2f.npz' % (filt, best_EWmean[ff], best_EWsig[ff]))
-            mylog.info("Writing : " + random_file)
-            np.savez(random_file, rand_logM=rand_logM, rand_logSFR=rand_logSFR,
-                     rand_offset=rand_offset, rand_mask=rand_mask)
-
-    sig_full_sq = wht_sig_full**2 * N_bins_filt
-    sig_full = np.sqrt(np.sum(sig_full_sq, axis=0) / np.sum(N_bins_filt, axis=0))
-
-    sig_sel_sq = wht_sig_sel**2 * N_bins_filt
-    sig_sel = np.sqrt(np.sum(sig_sel_sq, axis=0) / np.sum(N_bins_filt, axis=0))
+            random_file = None
+            if persist_mc:
+                random_file = join(npz_path0,
+                                   '%s_rand_SFR_%.2f_%0.2f.npz' % (filt, best_EWmean[ff], best_EWsig[ff]))
+                mylog.info("Writing : " + random_file)
+            rand_args.append((infile, random_file, N_bins, MC_Nsim))
+
+    # Filters are independent and can be randomized in separate processes
+    # Randomized arrays are kept in memory and files are only read when
+    # monte_carlo=False
+    if monte_carlo:
+        if n_jobs > 1:
+            with Pool(processes=n_jobs) as pool:
+                rand_results = pool.starmap(randomize_SFR_bins, rand_args)
+        else:
+            rand_results = [randomize_SFR_bins(*args) for args in rand_args]
+
+    sig_full = np.sqrt(wht_var_full / N_bins_tot)
+    sig_sel = np.sqrt(wht_var_sel / N_bins_tot)
 
     ax.plot(x_cen, sig_full, linestyle='dotted', label='Weighted (full)')
 
@@ -280,30 +356,43 @@ def compute_weighted_dispersion(best_fit_file, mylog, monte_carlo=False):
     # ax.plot(x_cen, sig_sel, linestyle='dashed', label='Weighted (selected)')
 
     # Plot distribution of randomized stddev
-    N_gal = np.zeros(len(x_cen))
-    offset_arr0 = np.empty((len(x_cen), MC_Nsim), dtype=np.object)
-    offset_std_arr0 = np.zeros((len(x_cen), MC_Nsim))
+    # Unmasked offsets of all filters are pooled in a flat (galaxy, MC)
+    # array.  Rows for mass bin bb start at bin_ptr[bb], so bins with few
+    # MACT galaxies are not padded to the largest bin
+    bin_ptr = np.append(0, np.cumsum(N_bins_tot))
+    offset_pool = np.empty((bin_ptr[-1], MC_Nsim), dtype=np.float32)
+    N_fill = np.zeros(len(x_cen), dtype=int)
 
     for filt, ff in zip(filters, range(len(filters))):
         # random_file = glob(filt + "_rand_SFR_*npz")[0]
-        random_file = join(npz_path0,
-                           '%s_rand_SFR_%.2f_%0.2f.npz' % (filt, best_EWmean[ff], best_EWsig[ff]))
-        r_npz0 = np.load(random_file)
-        t_offset = np.ma.array(r_npz0['rand_offset'], mask=r_npz0['rand_mask'])
+        if monte_carlo:
+            # Release arrays for each filter once they are pooled
+            rand_offset, rand_mask = rand_results[ff]
+            rand_results[ff] = None
+        else:
+            random_file = join(npz_path0,
+                               '%s_rand_SFR_%.2f_%0.2f.npz' % (filt, best_EWmean[ff], best_EWsig[ff]))
+            with np.load(random_file) as r_npz0:
+                rand_offset = r_npz0['rand_offset']
+                rand_mask = r_npz0['rand_mask']
+
         for bb in range(len(x_cen)):
-            for mm in range(MC_Nsim):
-                if ff == 0:
-                    offset_arr0[bb, mm] = np.array([])
-
-                unmask = t_offset[bb, :, mm].compressed()
-                if mm == 0:
-                    N_gal[bb] += len(unmask)
-                offset_arr0[bb, mm] = np.append(offset_arr0[bb, mm], unmask)
-
-                if ff == len(filters)-1:
-                    offset_std_arr0[bb, mm] = np.std(offset_arr0[bb, mm])
-            # if ff == len(filters)-1:
-            #     ax.scatter(np.repeat(x_cen[bb], MC_Nsim), offset_std_arr0[bb], s=5, color='black')
+            # Masking is the same for all MC realizations. Older files
+            # store the mask as 0/1 floats
+            use = ~rand_mask[bb, :, 0].astype(bool)
+            N_use = np.count_nonzero(use)
+            i0 = bin_ptr[bb] + N_fill[bb]
+            offset_pool[i0:i0+N_use] = rand_offset[bb, use]
+            N_fill[bb] += N_use
+
+    offset_std_arr0 = np.zeros((len(x_cen), MC_Nsim))
+    for bb in range(len(x_cen)):
+        if N_fill[bb] > 0:
+            offset_std_arr0[bb] = np.std(offset_pool[bin_ptr[bb]:bin_ptr[bb]+N_fill[bb]],
+                                         axis=0, dtype=np.float64)
+        else:
+            offset_std_arr0[bb] = np.nan
+    # ax.scatter(np.repeat(x_cen, MC_Nsim), offset_std_arr0.ravel(), s=5, color='black')
 
     err, xpeak = compute_onesig_pdf(offset_std_arr0, sig_sel, usepeak=True, silent=True)
     y1 = xpeak-err[:, 0]
@@ -0,0 +1,7 @@
+class PdfFileWriter:
+    def __init__(self): self.p=[]
+    def addPage(self,p): self.p.append(p)
+    def write(self,f): f.write(b'%PDF stub')
+class PdfFileReader:
+    def __init__(self,f): self.f=f
+    def getPage(self,i): return (self.f,i)